@@ -0,0 +1,103 @@
+import threading
+import time
+
+import sqlitehelper
+from sqlitehelper import IMAGE_DTYPES, _cast_df, _load_df
+from configuration import DB_PATH, ANALYTICS_MODE, ANALYTICS_REFRESH_INTERVAL
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# duckdb read path for the analytic queries of sqlitehelper, selected with
+# ANALYTICS_BACKEND = "duckdb". label writes always stay on sqlite. the
+# results match the sqlite ones, see tests/test_analytics.py
+
+IMAGE_COLUMNS = "filename, path, node_id, date, flower, pollinator, capture_type, favorite, available"
+
+_lock = threading.Lock()
+_duck = None
+_refreshed_at = None
+_refreshed_generation = None
+
+
+def get_duckdb():
+    # returns a cursor (a duckdb connection usable from this thread) on a
+    # database that has an images table or view
+    global _duck
+    with _lock:
+        if _duck is None:
+            if duckdb is None:
+                raise RuntimeError('ANALYTICS_BACKEND = "duckdb" needs the duckdb package')
+            _duck = duckdb.connect()
+            if ANALYTICS_MODE == "attach":
+                _duck.execute(
+                    "ATTACH '{}' AS src (TYPE sqlite, READ_ONLY)".format(
+                        DB_PATH.replace("'", "''")
+                    )
+                )
+                _duck.execute(
+                    """
+                    CREATE VIEW images AS SELECT
+                        filename, path, node_id, CAST(date AS TIMESTAMP) AS date,
+                        flower, pollinator, capture_type, favorite, available
+                    FROM src.images
+                    """
+                )
+        if ANALYTICS_MODE == "copy":
+            _refresh_copy()
+            if _refreshed_generation != sqlitehelper._current_generation():
+                # the copy is reloaded at most every ANALYTICS_REFRESH_INTERVAL
+                sqlitehelper._skip_cache()
+        return _duck.cursor()
+
+
+def _refresh_copy():
+    global _refreshed_at, _refreshed_generation
+    if _refreshed_at is not None:
+        if time.time() - _refreshed_at < ANALYTICS_REFRESH_INTERVAL:
+            return
+        if sqlitehelper._current_generation() == _refreshed_generation:
+            _refreshed_at = time.time()
+            return
+    t0 = time.time()
+    generation = sqlitehelper._current_generation()
+    c = sqlitehelper.get_connection().execute(
+        "SELECT {} FROM images".format(IMAGE_COLUMNS)
+    )
+    images = _load_df(c, IMAGE_DTYPES)
+    images["node_id"] = images["node_id"].astype("object")
+    _duck.register("images_df", images)
+    _duck.execute("CREATE OR REPLACE TABLE images AS SELECT * FROM images_df")
+    _duck.unregister("images_df")
+    _refreshed_at = time.time()
+    _refreshed_generation = generation
+    print("loaded", len(images), "images into duckdb in {:.1f}s".format(time.time() - t0))
+
+
+def get_all_data_as_df():
+    df = get_duckdb().execute(
+        "SELECT {} FROM images ORDER BY date DESC, filename".format(IMAGE_COLUMNS)
+    ).df()
+    if len(df) > 0:
+        return _cast_df(df, IMAGE_DTYPES)
+    return None
+
+
+def get_categorized_as_df():
+    df = get_duckdb().execute(
+        "SELECT {} FROM images WHERE flower IS NOT NULL ORDER BY filename".format(IMAGE_COLUMNS)
+    ).df()
+    return _cast_df(df, IMAGE_DTYPES)
+
+
+def get_image_dates_by_node_as_df(node_id):
+    return get_duckdb().execute(
+        """
+        SELECT DISTINCT strftime(date, '%Y-%m-%d') AS date FROM images
+        WHERE node_id = ? ORDER BY date
+        """,
+        [node_id],
+    ).df()
+
@@ -3,16 +3,18 @@ import os
 import random
 import datetime
 import fnmatch
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from sqlitehelper import *
-from tqdm import tqdm
+from configuration import SCAN_WORKERS, IMAGE_LIST_WINDOW, IMAGE_SERVER_URL
 
 
 class ImageList:
+    # position in the current selection of images, in (node_id, date) order.
+    # only a window of IMAGE_LIST_WINDOW rows around the position is held in
+    # memory, other windows are fetched with keyset queries
     def __init__(self, base_dir):
         self.base_dir = base_dir
-        self.files = [item for t in get_filepaths() for item in t]
-        self.index = 0
-        self.listlen = len(self.files)
+        self.update_filelist_by_selection()
 
     def update_filelist_by_selection(
         self,
@@ -23,30 +25,58 @@ class ImageList:
         enddate=None,
         seen_unseen_not_sure=1,
     ):
-        self.files = [
-            item
-            for t in get_filelist_by_selection(
-                node_id,
-                starttime_h,
-                endtime_h,
-                startdate,
-                enddate,
-                seen_unseen_not_sure,
-            )
-            for item in t
-        ]
-        print(len(self.files))
+        self.filters = {
+            "node_id": node_id,
+            "starttime_h": starttime_h,
+            "endtime_h": endtime_h,
+            "startdate": startdate,
+            "enddate": enddate,
+            "seen_unseen_not_sure": seen_unseen_not_sure,
+        }
+        self.listlen = get_selection_count(**self.filters)
+        print(self.listlen)
         self.index = 0
+        self.window = []
+        self.window_start = 0
+
+    def _load_window(self, index):
+        # makes sure index is inside the window, returns False if it is not
+        # part of the selection
+        window_end = self.window_start + len(self.window)
+        if self.window_start <= index < window_end:
+            return True
+        if index < 0:
+            return False
+        if len(self.window) > 0 and window_end <= index < window_end + IMAGE_LIST_WINDOW:
+            rows = get_selection_window(
+                self.filters,
+                IMAGE_LIST_WINDOW,
+                index - window_end,
+                after=self.window[-1],
+            )
+            start = index
+        elif len(self.window) > 0 and self.window_start - IMAGE_LIST_WINDOW <= index < self.window_start:
+            rows = get_selection_window(
+                self.filters,
+                IMAGE_LIST_WINDOW,
+                self.window_start - 1 - index,
+                before=self.window[0],
+            )
+            rows.reverse()
+            start = index - len(rows) + 1
+        else:
+            start = max(0, index - IMAGE_LIST_WINDOW // 2)
+            rows = get_selection_window(self.filters, IMAGE_LIST_WINDOW, start)
+        if len(rows) == 0 or not start <= index < start + len(rows):
+            return False
+        self.window = rows
+        self.window_start = start
+        return True
 
     def get_file_by_index(self, index):
-        try:
-            file = self.files[index]
-            if file:
-                return file
-            else:
-                return None
-        except IndexError:
+        if not self._load_window(index):
             return None
+        return self.window[index - self.window_start][3]
 
     def get_file(self):
         return self.get_file_by_index(self.index)
@@ -56,61 +86,195 @@ class ImageList:
         return self.get_file_by_index(self.index)
 
     def get_next_file(self):
-        self.index += 1
-        if self.index >= len(self.files):
-            self.index = 0
-        return self.get_file_by_index(self.index)
+        return self.get_file_skip_forward(1)
 
     def get_file_skip_forward(self, n):
         self.index += n
-        if self.index >= len(self.files):
+        file = self.get_file_by_index(self.index)
+        if file is None:
+            # ran past the end of the selection
             self.index = 0
-        return self.get_file_by_index(self.index)
+            file = self.get_file_by_index(self.index)
+        return file
 
     def get_file_skip_backward(self, n):
         self.index -= n
         if self.index < 0:
-            self.index = len(self.files) - 1
+            self.listlen = get_selection_count(**self.filters)
+            self.index = self.listlen - 1
         return self.get_file_by_index(self.index)
 
     def get_previous_file(self):
-        self.index -= 1
-        if self.index < 0:
-            self.index = len(self.files) - 1
-        return self.get_file_by_index(self.index)
+        return self.get_file_skip_backward(1)
+
+    def get_neighbours(self, n):
+        # paths of up to n images after and n before the current one, nearest
+        # first, without moving the position. rows beyond the window are
+        # fetched with a keyset query, the window itself stays where it is
+        if not self._load_window(self.index):
+            return []
+        i = self.index - self.window_start
+        after = self.window[i + 1 : i + 1 + n]
+        if len(after) < n and self.window_start + len(self.window) < self.listlen:
+            after += get_selection_window(
+                self.filters, n - len(after), after=self.window[-1]
+            )
+        before = self.window[max(i - n, 0) : i][::-1]
+        if len(before) < n and self.window_start > 0:
+            # nearest first, like the rows of the before query
+            before += get_selection_window(
+                self.filters, n - len(before), before=self.window[0]
+            )
+        return [row[3] for row in after + before]
 
     def get_random_file(self):
-        self.index = random.randint(0, len(self.files) - 1)
+        if self.listlen == 0:
+            return None
+        self.index = random.randint(0, self.listlen - 1)
         return self.get_file_by_index(self.index)
 
-    def update_filelist(self):
-        self.files = get_file_list(self.base_dir)
 
+def image_url(path, width=None):
+    # url of an image (path relative to BASE_PATH), optionally resized
+    url = "/image/" + path
+    if IMAGE_SERVER_URL is not None:
+        url = IMAGE_SERVER_URL + url
+    if width is not None:
+        url += "?w={}".format(width)
+    return url
 
-def get_file_list(base_dir):
+
+def _parallel_walk(visit, root, workers):
+    # breadth-first walk where each visit(item) runs on a bounded thread pool
+    # and returns (result, child_items); results are yielded as they complete
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(visit, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, children = future.result()
+                for child in children:
+                    pending.add(pool.submit(visit, child))
+                yield result
+
+
+def _list_dir(base_dir, rel_dir):
+    # returns the jpg files and subdirectories of rel_dir, both relative to
+    # base_dir, or None if it cannot be listed. like os.walk, symlinked
+    # directories are not descended into and unreadable ones are skipped
     files = []
-    i = 0
-    for root, dirnames, filenames in os.walk(base_dir):
-        for filename in fnmatch.filter(filenames, "*.jpg"):
+    subdirs = []
+    entry_count = 0
+    try:
+        with os.scandir(os.path.join(base_dir, rel_dir)) as it:
+            for entry in it:
+                entry_count += 1
+                rel_path = entry.name if rel_dir == "" else rel_dir + "/" + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(rel_path)
+                elif fnmatch.fnmatch(entry.name, "*.jpg"):
+                    files.append(rel_path)
+    except OSError as e:
+        print("could not list", os.path.join(base_dir, rel_dir), e)
+        return None
+    return files, subdirs, entry_count
+
 
-            files.append(os.path.join(root, filename).replace("\\", "/"))
+def iter_file_list(base_dir, workers=SCAN_WORKERS):
+    # yields the jpg paths below base_dir (relative to it) while the scan is running
+    def visit(rel_dir):
+        listing = _list_dir(base_dir, rel_dir)
+        if listing is None:
+            return [], []
+        files, subdirs, entry_count = listing
+        return files, subdirs
+
+    i = 0
+    for files in _parallel_walk(visit, "", workers):
+        for f in files:
+            yield f
             i += 1
             if i % 1000 == 0:
-                print(i, filename)
+                print(i, f)
+
+
+def get_file_list(base_dir):
+    files = [
+        os.path.join(base_dir, f).replace("\\", "/") for f in iter_file_list(base_dir)
+    ]
     print("Found", len(files), "files on path:", base_dir)
     return files
 
 
 def update_db(base_path):
-    files = get_file_list(base_path)
-    if len(files) > 0:
-        for i in tqdm(range(len(files))):
-            files[i] = files[i].split(base_path)[1]
+    stats = bulk_ingest(iter_file_list(base_path))
+    if stats["scanned"] == 0:
+        print("No files found on path: " + base_path)
 
-        insert_from_list(files)
-        set_available_from_list(files)
+
+def scan_changed_dirs(base_path, manifest, scan, workers=SCAN_WORKERS):
+    # walks base_path but only lists directories whose mtime differs from the
+    # manifest; unchanged directories are descended into via the manifest.
+    # yields the jpg paths (relative to base_path) found in changed directories
+    # and fills scan with the changed directories, the new manifest entries and
+    # the vanished directories once the generator is exhausted
+    children = {}
+    for d, (parent, mtime_ns, entry_count) in manifest.items():
+        children.setdefault(parent, []).append(d)
+
+    def visit(item):
+        rel_dir, parent = item
+        try:
+            mtime_ns = os.stat(os.path.join(base_path, rel_dir)).st_mtime_ns
+        except OSError:
+            return None, []
+        known = manifest.get(rel_dir)
+        if known is not None and known[1] == mtime_ns:
+            return (rel_dir, None, None), [(c, rel_dir) for c in children.get(rel_dir, [])]
+        listing = _list_dir(base_path, rel_dir)
+        if listing is None:
+            # treated like a vanished directory
+            return None, []
+        files, subdirs, entry_count = listing
+        return (rel_dir, files, (parent, mtime_ns, entry_count)), [(d, rel_dir) for d in subdirs]
+
+    scan["changed"] = set()
+    scan["entries"] = {}
+    visited = set()
+    n_files = 0
+    for result in _parallel_walk(visit, ("", None), workers):
+        if result is None:
+            continue
+        rel_dir, files, entry = result
+        visited.add(rel_dir)
+        if files is None:
+            continue
+        scan["changed"].add(rel_dir)
+        scan["entries"][rel_dir] = entry
+        n_files += len(files)
+        yield from files
+    scan["removed"] = set(manifest) - visited
+    print(
+        "Scanned", len(scan["changed"]), "changed directories,", len(scan["removed"]), "vanished,",
+        len(visited) - len(scan["changed"]), "unchanged; found", n_files, "files",
+    )
+
+
+def update_db_incremental(base_path):
+    manifest = get_scan_manifest()
+    scan = {}
+    files = scan_changed_dirs(base_path, manifest, scan)
+    if len(manifest) == 0:
+        # first run, nothing to compare against
+        bulk_ingest(files)
     else:
-        print("No files found on path: " + base_path)
+        # the changed directories are only known once bulk_ingest has consumed files
+        bulk_ingest(
+            files,
+            full_sync=False,
+            changed_dirs=lambda: scan["changed"] | scan["removed"],
+        )
+    save_scan_manifest(scan["entries"], scan["removed"])
 
 
 def get_file_by_index(index):
@@ -119,13 +283,3 @@ def get_file_by_index(index):
     if index >= leng:
         return None
     return files[index]
-
-
-def get_metadata_from_filename(filename):
-    if "/" in filename:
-        filename = filename.split("/")[-1]
-    node_id = filename.split("_")[0]
-    date = filename.split("_")[1]
-    date = date.split(".")[0]
-    dt = datetime.datetime.strptime(date, "%Y-%m-%dT%H-%M-%SZ")
-    return node_id, dt
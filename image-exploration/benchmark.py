@@ -0,0 +1,275 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+import configuration
+
+# imported in main(), once DB_PATH points into the workdir
+sqlitehelper = None
+
+# synthetic-scale benchmark of the sqlitehelper layer.
+# usage: python benchmark.py --scales 100000,1000000 --out bench.json
+# every scale gets a fresh database in --workdir, filled with captures of
+# --nodes camera nodes, each active for part of a season during daylight.
+# every public function of sqlitehelper is timed, apart from these
+NOT_BENCHMARKED = {
+    "cached_read": "decorator",
+    "instrumented": "decorator",
+    "writes": "decorator",
+    "get_connection": "called by every benchmarked function",
+    "get_read_connection": "called by every benchmarked read",
+    "release_connection": "called by every benchmarked function",
+    "close_connection": "called between the scales",
+    "print_data": "prints every row, get_data is timed",
+    "start_read_snapshot": "starts a background thread",
+}
+
+
+def generate_paths(n_images, n_nodes, seed):
+    rng = random.Random(seed)
+    per_node = n_images // n_nodes
+    paths = []
+    for i in range(n_nodes):
+        node_id = "{:012x}".format(rng.getrandbits(48))
+        start = datetime.datetime(2022, 4, 1) + datetime.timedelta(days=rng.randint(0, 60))
+        days = rng.randint(30, 120)
+        # captures are spread over days x daylight hours with some jitter
+        interval = days * 14 * 3600 / per_node
+        t = 0.0
+        for _ in range(per_node):
+            t += interval * rng.uniform(0.5, 1.5)
+            day, second = divmod(t, 14 * 3600)
+            dt = start + datetime.timedelta(days=int(day), hours=6, seconds=int(second))
+            paths.append(
+                "{0}/{1:%Y-%m-%d}/{0}_{1:%Y-%m-%dT%H-%M-%S}Z.jpg".format(node_id, dt)
+            )
+    return paths
+
+
+def timed(func, *args, repeat=5, **kwargs):
+    times = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    rows = None
+    if isinstance(result, (list, pd.DataFrame)):
+        rows = len(result)
+    elif isinstance(result, dict) and "scanned" in result:
+        # bulk_ingest stats
+        rows = result["scanned"]
+    return summarize(times, rows)
+
+
+def summarize(times, rows):
+    # summary of the samples of one benchmark, rows per call
+    report = {
+        "min": min(times),
+        "median": statistics.median(times),
+        "repeat": len(times),
+        "rows": rows,
+    }
+    if rows:
+        report["rows_per_sec"] = rows / max(report["median"], 1e-9)
+    return report
+
+
+def uncached(func):
+    # the read cache would turn every repetition after the first into a hit
+    return getattr(func, "uncached", func)
+
+
+def missing_functions(results):
+    # public functions of sqlitehelper without a result. the results are
+    # named after the function, optionally followed by " (variant)"
+    covered = {name.split(" ")[0] for name in results}
+    public = {
+        name
+        for name, value in vars(sqlitehelper).items()
+        if not name.startswith("_")
+        and callable(value)
+        and getattr(value, "__module__", None) == "sqlitehelper"
+        and not isinstance(value, type)
+    }
+    return sorted(public - covered - set(NOT_BENCHMARKED))
+
+
+def run_scale(n_images, n_nodes, workdir, repeat, seed):
+    db_path = os.path.join(workdir, "bench_{}.db".format(n_images))
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    # no archived seasons of the real database or of another scale
+    archive_dir = os.path.join(workdir, "bench_archive_{}".format(n_images))
+    shutil.rmtree(archive_dir, ignore_errors=True)
+    sqlitehelper.close_connection()
+    sqlitehelper.DB_PATH = db_path
+    sqlitehelper.ARCHIVE_DIR = archive_dir
+    results = {"migrate": timed(sqlitehelper.migrate, repeat=1)}
+
+    rng = random.Random(seed)
+    paths = generate_paths(n_images, n_nodes, seed)
+    results["bulk_ingest (initial)"] = timed(sqlitehelper.bulk_ingest, paths, repeat=1)
+    results["bulk_ingest (re-sync)"] = timed(sqlitehelper.bulk_ingest, paths, repeat=1)
+
+    filenames = [p.rsplit("/", 1)[-1] for p in paths]
+    labeled = rng.sample(filenames, len(filenames) // 3)
+    flowers = {f: rng.choice([1, 0, -1]) for f in labeled}
+    favorites = {f: 1 for f in rng.sample(labeled, len(labeled) // 50)}
+    results["set_labels"] = timed(sqlitehelper.set_labels, flowers, favorites, repeat=1)
+    box = {"id": 0, "cx": 10, "cy": 10, "w": 5, "h": 5, "x0": 8, "y0": 8, "x1": 13, "y1": 13}
+    annotated = rng.sample(labeled, max(1, len(labeled) // 100))
+    times = []
+    for f in annotated:
+        t0 = time.perf_counter()
+        sqlitehelper.replace_annotations(f, 2, [box, dict(box, id=1)], 1920, 1080)
+        times.append(time.perf_counter() - t0)
+    results["replace_annotations (x{})".format(len(annotated))] = summarize(times, 2)
+    sqlitehelper.get_connection().execute("ANALYZE")
+
+    node_ids = [row[0] for row in sqlitehelper.get_node_ids(True)]
+    node_id = node_ids[0]
+    filename = rng.choice(filenames)
+    mid = paths[len(paths) // 2]
+    day = mid.split("/")[1]
+    reads = [
+        ("get_node_ids", sqlitehelper.get_node_ids, ()),
+        ("get_counts", sqlitehelper.get_counts, ()),
+        ("get_counts_by_node_as_df", sqlitehelper.get_counts_by_node_as_df, ()),
+        ("get_categorized_as_df", sqlitehelper.get_categorized_as_df, ()),
+        ("get_all_data_as_df", sqlitehelper.get_all_data_as_df, ()),
+        ("get_data_by_node_as_df", sqlitehelper.get_data_by_node_as_df, (node_id, True)),
+        ("get_image_dates_by_node_as_df", sqlitehelper.get_image_dates_by_node_as_df, (node_id,)),
+        ("get_filepaths", sqlitehelper.get_filepaths, ()),
+        ("get_filelist_by_selection (all)", sqlitehelper.get_filelist_by_selection, ()),
+        ("get_filelist_by_selection (node)", sqlitehelper.get_filelist_by_selection, (node_id,)),
+        ("get_filelist_by_selection (node, 10-14h)", sqlitehelper.get_filelist_by_selection, (node_id, 10, 14)),
+        ("get_filelist_by_selection (day)", sqlitehelper.get_filelist_by_selection, (None, None, None, day, day)),
+        ("get_filelist_by_selection (unseen)", sqlitehelper.get_filelist_by_selection, (None, None, None, None, None, 2)),
+        ("get_selection_count (node)", lambda: sqlitehelper.get_selection_count(node_id=node_id), ()),
+        ("get_selection_window (offset middle)", sqlitehelper.get_selection_window, ({}, 300, len(paths) // 2)),
+        ("get_annotated_filenames", sqlitehelper.get_annotated_filenames, (2,)),
+        ("get_all_annotations", sqlitehelper.get_all_annotations, (2,)),
+        ("select_annotations", sqlitehelper.select_annotations, (annotated[0], 2)),
+        ("check_if_exists", sqlitehelper.check_if_exists, (filename,)),
+        ("check_if_file_available", sqlitehelper.check_if_file_available, (filename,)),
+        ("get_path_from_filename", sqlitehelper.get_path_from_filename, (filename,)),
+        ("get_data", sqlitehelper.get_data, ()),
+        ("selection_query", sqlitehelper.selection_query, (node_id, 10, 14)),
+        ("explain_selection", lambda: sqlitehelper.explain_selection(node_id=node_id), ()),
+        ("get_schema_version", sqlitehelper.get_schema_version, ()),
+        ("get_archived_seasons", sqlitehelper.get_archived_seasons, ()),
+        ("get_metrics", sqlitehelper.get_metrics, ()),
+    ]
+    for name, func, args in reads:
+        results[name] = timed(uncached(func), *args, repeat=repeat)
+    results["get_counts_by_node_as_df (cached)"] = timed(
+        sqlitehelper.get_counts_by_node_as_df, repeat=repeat
+    )
+    writes = [
+        ("set_flower", sqlitehelper.set_flower, (filename, 1)),
+        ("set_favorite", sqlitehelper.set_favorite, (filename, 1)),
+        ("replace_annotations", sqlitehelper.replace_annotations, (filename, 2, [box], 1920, 1080)),
+    ]
+    for name, func, args in writes:
+        results[name] = timed(func, *args, repeat=repeat)
+
+    # directories of the captures as a scan of them would record them
+    entries = {}
+    for path in paths:
+        node_dir, day_dir = path.rsplit("/", 1)[0].split("/")
+        entries.setdefault(node_dir, ["", 0, 0])[2] += 1
+        entries.setdefault(node_dir + "/" + day_dir, [node_dir, 0, 0])[2] += 1
+    entries = {d: tuple(e) for d, e in entries.items()}
+    results["save_scan_manifest"] = timed(sqlitehelper.save_scan_manifest, entries, repeat=1)
+    results["get_scan_manifest"] = timed(sqlitehelper.get_scan_manifest, repeat=repeat)
+    results["clear_scan_manifest"] = timed(sqlitehelper.clear_scan_manifest, repeat=1)
+
+    # row by row writes of the older code paths, on a sample of the images
+    sample = rng.sample(paths, min(len(paths), 1000))
+    new_paths = generate_paths(len(sample), 1, seed + 1)
+    results["insert_from_list"] = timed(sqlitehelper.insert_from_list, new_paths, repeat=1)
+    results["set_unavailable_from_list"] = timed(
+        sqlitehelper.set_unavailable_from_list, sample, repeat=1
+    )
+    results["set_available_from_list"] = timed(
+        sqlitehelper.set_available_from_list, sample, repeat=1
+    )
+    node, day = new_paths[0].split("/")[:2]
+    insert_args = (
+        "bench_insert_data.jpg",
+        "{}/{}/bench_insert_data.jpg".format(node, day),
+        node,
+        datetime.datetime.fromisoformat(day).replace(hour=12),
+    )
+    results["insert_data"] = timed(sqlitehelper.insert_data, *insert_args, repeat=repeat)
+    box_args = (0, 10, 10, 5, 5, 8, 8, 13, 13, 1920, 1080, 2)
+    results["insert_annotation"] = timed(
+        sqlitehelper.insert_annotation, filename, *box_args, repeat=repeat
+    )
+    results["remove_annotations"] = timed(
+        sqlitehelper.remove_annotations, filename, 2, repeat=repeat
+    )
+    results["set_all_not_available"] = timed(sqlitehelper.set_all_not_available, repeat=1)
+    # moves every image of the season out of DB_PATH, so it comes last
+    results["archive_season"] = timed(sqlitehelper.archive_season, 2022, repeat=1)
+    sqlitehelper.close_connection()
+    return {
+        "images": len(paths),
+        "nodes": n_nodes,
+        "db_bytes": os.path.getsize(db_path),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the sqlitehelper layer")
+    parser.add_argument("--scales", default="10000,100000", help="comma separated image counts")
+    parser.add_argument("--nodes", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=tempfile.gettempdir())
+    parser.add_argument("--out", default=None, help="write the json report to this file")
+    args = parser.parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+
+    # sqlitehelper creates DB_PATH on import, keep it away from the real one
+    global sqlitehelper
+    configuration.DB_PATH = os.path.join(args.workdir, "bench_import.db")
+    configuration.ARCHIVE_DIR = os.path.join(args.workdir, "bench_archive")
+    configuration.SLOW_QUERY_LOG_PATH = os.path.join(args.workdir, "bench_slow_queries.jsonl")
+    import sqlitehelper
+
+    report = {
+        "started": datetime.datetime.now().isoformat(),
+        "sqlite_version": sqlite3.sqlite_version,
+        "schema_version": len(sqlitehelper.MIGRATIONS),
+        "scales": [],
+    }
+    for scale in [int(s) for s in args.scales.split(",")]:
+        print("benchmarking", scale, "images")
+        report["scales"].append(
+            run_scale(scale, args.nodes, args.workdir, args.repeat, args.seed)
+        )
+        missing = missing_functions(report["scales"][-1]["results"])
+        if len(missing) > 0:
+            raise SystemExit("not benchmarked: " + ", ".join(missing))
+    text = json.dumps(report, indent=2)
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,89 @@
 BASE_PATH = "E:/Originals/"
 DB_PATH = "flower_image_db.db"
 
+# past seasons moved out of DB_PATH by `update_db.py --archive YEAR` are
+# kept as read-only databases in ARCHIVE_DIR, attached to every connection
+ARCHIVE_DIR = "archive"
+
+# number of query results kept by the sqlitehelper read cache
+READ_CACHE_SIZE = 128
+
+# rows of the explorer selection held in memory around the current image
+IMAGE_LIST_WINDOW = 300
+
+# write-behind for labels set in the explorer: labels are acknowledged
+# immediately, journaled to LABEL_JOURNAL_PATH and written to the DB in
+# batches every LABEL_FLUSH_INTERVAL seconds
+LABEL_WRITE_BEHIND = False
+LABEL_FLUSH_INTERVAL = 0.5
+LABEL_JOURNAL_PATH = "label_journal.jsonl"
+
+# backend for the read-only analytic queries (chart page, image dates):
+# "sqlite", or "duckdb" to run them in an embedded duckdb (needs the duckdb
+# package). ANALYTICS_MODE "attach" reads DB_PATH live through duckdb's
+# sqlite extension, "copy" loads the images table into duckdb and reloads it
+# at most every ANALYTICS_REFRESH_INTERVAL seconds once the DB has changed
+ANALYTICS_BACKEND = "sqlite"
+ANALYTICS_MODE = "copy"
+ANALYTICS_REFRESH_INTERVAL = 60
+
+# number of threads listing directories in parallel when scanning BASE_PATH
+SCAN_WORKERS = 16
+
+# update_db.py --watch: seconds between batched DB writes of file events,
+# and between rescans when falling back to polling (watchdog not installed)
+WATCH_FLUSH_INTERVAL = 0.3
+WATCH_POLL_INTERVAL = 30
+
+# resized variants served by /image/<path>?w=<width>&q=<quality>: widths are
+# rounded up to one of THUMBNAIL_WIDTHS, variants are cached on disk in
+# THUMBNAIL_CACHE_DIR up to THUMBNAIL_CACHE_BYTES (least recently used first
+# out). needs Pillow, without it the originals are served
+THUMBNAIL_CACHE_DIR = "thumbnail_cache"
+THUMBNAIL_CACHE_BYTES = 2 * 1024**3
+THUMBNAIL_WIDTHS = [300, 600, 1280, 1920]
+THUMBNAIL_QUALITY = 80
+
+# separate image server (python imageserver.py) for /image/<path>, which
+# sends files with sendfile and keeps transfers off the dash workers. with
+# IMAGE_SERVER_URL set (e.g. "http://localhost:8051") the pages load images
+# from there instead of the /image route of the dash app.
+# IMAGE_SERVER_CONCURRENCY requests are answered at a time, stat and
+# resizing run on IMAGE_SERVER_WORKERS threads
+IMAGE_SERVER_URL = None
+IMAGE_SERVER_HOST = "0.0.0.0"
+IMAGE_SERVER_PORT = 8051
+IMAGE_SERVER_CONCURRENCY = 64
+IMAGE_SERVER_WORKERS = 8
+
+# images after and before the current one in the explorer that the browser
+# preloads and whose variants are created ahead of time by
+# THUMBNAIL_WARM_WORKERS background threads (by the image server if
+# IMAGE_SERVER_URL is set)
+EXPLORER_PREFETCH = 3
+THUMBNAIL_WARM_WORKERS = 2
+
+# Cache-Control max-age (seconds) of the responses of /image, which are
+# also marked immutable
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
+# memory budget of the decoded images kept by the annotation pages
+DECODED_IMAGE_CACHE_BYTES = 512 * 1024**2
+
+# optional in-memory copy of DB_PATH that the dash app reads from, made with
+# VACUUM INTO. writes go to DB_PATH and are mirrored into the copy,
+# which is reloaded every READ_SNAPSHOT_REFRESH_INTERVAL seconds once the DB
+# has been changed by another connection or process
+READ_SNAPSHOT = False
+READ_SNAPSHOT_REFRESH_INTERVAL = 60
+
+# sqlitehelper instrumentation: calls slower than SLOW_QUERY_MS are logged
+# with the query plans of their statements to SLOW_QUERY_LOG_PATH (None to
+# only keep them in memory); latency histograms cover the last METRICS_WINDOW
+# seconds and are served on /metrics
+SLOW_QUERY_MS = 250
+SLOW_QUERY_LOG_PATH = "slow_queries.jsonl"
+METRICS_WINDOW = 600
+
 PORT = 8050
 HOST = "0.0.0.0"
@@ -0,0 +1,103 @@
+import datetime
+import numpy as np
+import pandas as pd
+
+# parsing of capture filenames like NODE_2021-06-26T11-04-04Z.jpg
+
+# positions of the digits and separators in 2021-06-26T11-04-04Z
+DIGIT_COLUMNS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+SEPARATOR_COLUMNS = [4, 7, 10, 13, 16, 19]
+SEPARATORS = np.array([ord(c) for c in "--T--Z"], dtype=np.uint32)
+
+
+def get_metadata_from_filename(filename):
+    if "/" in filename:
+        filename = filename.split("/")[-1]
+    node_id, date = filename.split("_")[:2]
+    date = date.split(".")[0]
+    # fixed offsets of 2021-06-26T11-04-04Z, strptime for anything else
+    if len(date) == 20 and date[10] == "T" and date[19] == "Z":
+        try:
+            dt = datetime.datetime(
+                int(date[0:4]),
+                int(date[5:7]),
+                int(date[8:10]),
+                int(date[11:13]),
+                int(date[14:16]),
+                int(date[17:19]),
+            )
+            return node_id, dt
+        except ValueError:
+            pass
+    dt = datetime.datetime.strptime(date, "%Y-%m-%dT%H-%M-%SZ")
+    return node_id, dt
+
+
+def get_time_columns(date):
+    # minute_of_day and epoch as stored next to date; dates are UTC
+    if isinstance(date, str):
+        date = datetime.datetime.fromisoformat(date)
+    epoch = int(date.replace(tzinfo=datetime.timezone.utc).timestamp())
+    return date.hour * 60 + date.minute, epoch
+
+
+def parse_filenames(paths):
+    # vectorized variant for a batch of paths. returns a dataframe with the
+    # columns ingest writes: filename, path, node_id, date (as sqlite stores
+    # datetimes), minute_of_day and epoch
+    paths = list(paths)
+    filenames = [p.rpartition("/")[2] for p in paths]
+    heads = [f.partition("_") for f in filenames]
+    node_ids = [h[0] for h in heads]
+    # the timestamp has to be followed by the extension or another _ part,
+    # anything else is left to the scalar parser by blanking it
+    stamps = np.array(
+        [h[2][:20] if h[2][20:21] in (".", "_", "") else "" for h in heads],
+        dtype="U20",
+    )
+    # one row of 20 unicode code points per timestamp
+    chars = stamps.view(np.uint32).reshape(-1, 20)
+    digits = chars[:, DIGIT_COLUMNS].astype(np.int64) - ord("0")
+    valid = np.all((digits >= 0) & (digits <= 9), axis=1) & np.all(
+        chars[:, SEPARATOR_COLUMNS] == SEPARATORS, axis=1
+    )
+    # field values in range, anything else goes to the scalar parser
+    fields = digits[:, 0::2] * 10 + digits[:, 1::2]
+    year = fields[:, 0] * 100 + fields[:, 1]
+    month, day, hour, minute, second = fields[:, 2:].T
+    months = ((year - 1970) * 12 + np.clip(month, 1, 12) - 1).astype("datetime64[M]")
+    days_in_month = (months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")
+    valid &= (
+        (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month.astype(np.int64))
+        & (hour < 24) & (minute < 60) & (second < 60)
+    )
+    if not valid.all():
+        # placeholder for the rows the scalar parser handles below
+        stamps[~valid] = "1970-01-01T00-00-00Z"
+        digits = chars[:, DIGIT_COLUMNS].astype(np.int64) - ord("0")
+    days = stamps.astype("U10").astype("datetime64[D]").astype(np.int64)
+    hour = digits[:, 8] * 10 + digits[:, 9]
+    minute = digits[:, 10] * 10 + digits[:, 11]
+    second = digits[:, 12] * 10 + digits[:, 13]
+    # 2021-06-26T11-04-04Z -> 2021-06-26 11:04:04
+    date_chars = chars[:, :19].copy()
+    date_chars[:, 10] = ord(" ")
+    date_chars[:, [13, 16]] = ord(":")
+    dates = date_chars.copy().view("U19").ravel()
+    df = pd.DataFrame(
+        {
+            "filename": filenames,
+            "path": paths,
+            "node_id": node_ids,
+            "date": dates.astype("object"),
+            "minute_of_day": hour * 60 + minute,
+            "epoch": days * 86400 + hour * 3600 + minute * 60 + second,
+        }
+    )
+    # names strptime accepts without the fixed offsets (e.g. 2021-6-26T...)
+    # are parsed one by one, bad names raise here
+    for i in np.flatnonzero(~valid):
+        node_id, dt = get_metadata_from_filename(filenames[i])
+        minute_of_day, epoch = get_time_columns(dt)
+        df.iloc[i, 2:] = [node_id, str(dt), minute_of_day, epoch]
+    return df
@@ -0,0 +1,91 @@
+import os
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+from flask import has_request_context, request
+from skimage import io
+
+from configuration import BASE_PATH, DECODED_IMAGE_CACHE_BYTES, IMAGE_SERVER_URL
+
+# decoded images for the annotation pages, which show an image and read it
+# again to store the image size with the annotations. entries are keyed by
+# path, mtime and size, the least recently used ones are dropped once the
+# arrays take more than DECODED_IMAGE_CACHE_BYTES. the arrays are shared
+# between callers and therefore read-only
+
+
+class DecodedImageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (path, mtime_ns, size) -> array, oldest first
+        self.keys = {}  # path -> its current key
+        self.total_bytes = 0
+
+    def get(self, path):
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with self.lock:
+            img = self.entries.get(key)
+            if img is not None:
+                self.entries.move_to_end(key)
+                return img
+        img = io.imread(path)
+        img.flags.writeable = False
+        if img.nbytes > self.max_bytes:
+            return img
+        with self.lock:
+            if key not in self.entries:
+                # an older version of the file is not needed anymore
+                self._remove(self.keys.get(path))
+                self.entries[key] = img
+                self.keys[path] = key
+                self.total_bytes += img.nbytes
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+        return img
+
+    def _remove(self, key):
+        img = self.entries.pop(key, None)
+        if img is not None:
+            self.total_bytes -= img.nbytes
+            if self.keys.get(key[0]) == key:
+                del self.keys[key[0]]
+
+
+_cache = DecodedImageCache(DECODED_IMAGE_CACHE_BYTES)
+
+
+def image_routes():
+    # url prefixes under which BASE_PATH is served: the /image route of this
+    # app, as the browser addresses it, and the image server
+    routes = []
+    if has_request_context():
+        routes.append(request.host_url + "image/")
+    if IMAGE_SERVER_URL is not None:
+        routes.append(IMAGE_SERVER_URL.rstrip("/") + "/image/")
+    return routes
+
+
+def local_path(src):
+    # file below BASE_PATH for an image url of this app or of the image
+    # server, None for other urls
+    if "://" not in src:
+        return src
+    url = urllib.parse.urlsplit(src)
+    # without query (?w=) and fragment
+    src = urllib.parse.urlunsplit((url.scheme, url.netloc, url.path, "", ""))
+    for route in image_routes():
+        if src.startswith(route):
+            return BASE_PATH + urllib.parse.unquote(src[len(route):])
+    return None
+
+
+def read_image(src):
+    # like skimage.io.imread, for a path or an image url; images of BASE_PATH
+    # are decoded once and then served from the cache
+    path = local_path(src)
+    if path is None or not os.path.exists(path):
+        return io.imread(src)
+    return _cache.get(path)
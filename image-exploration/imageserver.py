@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import email.utils
+import os
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from configuration import (
+    BASE_PATH,
+    THUMBNAIL_QUALITY,
+    IMAGE_MAX_AGE,
+    IMAGE_SERVER_HOST,
+    IMAGE_SERVER_PORT,
+    IMAGE_SERVER_CONCURRENCY,
+    IMAGE_SERVER_WORKERS,
+)
+from thumbnails import get_variant, file_etag
+
+# standalone server for /image/<path>[?w=<width>&q=<quality>], so image
+# transfers do not hold up the workers of the dash app. the dash app links
+# here when IMAGE_SERVER_URL is set. run with: python imageserver.py
+# file bodies are sent with loop.sendfile, i.e. os.sendfile (zero-copy) on
+# plain tcp sockets. responses are the same as those of main.return_image
+
+KEEP_ALIVE_TIMEOUT = 30
+MAX_HEADER_BYTES = 16384
+MAX_BODY_BYTES = 65536
+
+STATUS_TEXT = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    416: "Range Not Satisfiable",
+}
+
+
+class ImageServer:
+    def __init__(self, base_path, concurrency, workers):
+        self.base_path = base_path
+        self.real_base_path = os.path.realpath(base_path)
+        # transfers in progress, further requests wait for a free slot
+        self.slots = asyncio.Semaphore(concurrency)
+        # stat and resizing block, they run on these threads
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT
+                    )
+                except (
+                    asyncio.TimeoutError,
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                ):
+                    break
+                method, target, version, headers = parse_request(head)
+                if method is None:
+                    await self.respond(writer, 400, close=True)
+                    break
+                connection = headers.get("connection", "").lower()
+                close = connection == "close" or (
+                    version == "HTTP/1.0" and connection != "keep-alive"
+                )
+                # bodies are not used, but must not be parsed as the next
+                # request. small ones are skipped, otherwise the connection
+                # is closed after the response
+                try:
+                    body_length = int(headers.get("content-length", 0))
+                except ValueError:
+                    await self.respond(writer, 400, close=True)
+                    break
+                if "transfer-encoding" in headers or not 0 <= body_length <= MAX_BODY_BYTES:
+                    close = True
+                elif body_length > 0:
+                    try:
+                        await asyncio.wait_for(
+                            reader.readexactly(body_length), KEEP_ALIVE_TIMEOUT
+                        )
+                    except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                        break
+                async with self.slots:
+                    await self.handle_request(writer, method, target, headers, close)
+                if close:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, writer, method, target, headers, close):
+        if method not in ("GET", "HEAD"):
+            await self.respond(writer, 405, {"Allow": "GET, HEAD"}, close=close)
+            return
+        url = urllib.parse.urlsplit(target)
+        if not url.path.startswith("/image/"):
+            await self.respond(writer, 404, close=close)
+            return
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            width = int(query["w"][0]) if "w" in query else None
+            quality = int(query["q"][0]) if "q" in query else THUMBNAIL_QUALITY
+        except ValueError:
+            await self.respond(writer, 400, close=close)
+            return
+        path = urllib.parse.unquote(url.path[len("/image/"):])
+        loop = asyncio.get_running_loop()
+        try:
+            filepath, st, src_st = await loop.run_in_executor(
+                self.executor, self.resolve, path, width, quality
+            )
+        except OSError:
+            # missing, outside base_path or not an image that can be resized
+            await self.respond(writer, 404, close=close)
+            return
+
+        etag = '"{}"'.format(file_etag(src_st, width, quality))
+        response_headers = {
+            "Content-Type": "image/jpeg",
+            "ETag": etag,
+            "Last-Modified": email.utils.formatdate(src_st.st_mtime, usegmt=True),
+            "Cache-Control": "public, max-age={}, immutable".format(IMAGE_MAX_AGE),
+            "Accept-Ranges": "bytes",
+        }
+        if not_modified(headers, etag, src_st.st_mtime):
+            await self.respond(writer, 304, response_headers, close=close)
+            return
+
+        status, offset, count = 200, 0, st.st_size
+        range_header = headers.get("range")
+        if range_header is not None and headers.get("if-range", etag) == etag:
+            byte_range = parse_range(range_header, st.st_size)
+            if byte_range is False:
+                response_headers["Content-Range"] = "bytes */{}".format(st.st_size)
+                await self.respond(writer, 416, response_headers, close=close)
+                return
+            if byte_range is not None:
+                status, (offset, count) = 206, byte_range
+                response_headers["Content-Range"] = "bytes {}-{}/{}".format(
+                    offset, offset + count - 1, st.st_size
+                )
+        response_headers["Content-Length"] = str(count)
+        if method == "HEAD":
+            await self.respond(writer, status, response_headers, close=close, length=False)
+            return
+        with open(filepath, "rb") as f:
+            await self.respond(writer, status, response_headers, close=close, length=False)
+            await loop.sendfile(writer.transport, f, offset, count)
+
+    def resolve(self, path, width, quality):
+        # file to send for path below base_path, its stat and the stat of the
+        # original, which the validators are derived from. the path is built
+        # like in main.return_image so variants share the cache keys
+        filepath = self.base_path + path
+        real_path = os.path.realpath(filepath)
+        if os.path.commonpath([real_path, self.real_base_path]) != self.real_base_path:
+            raise FileNotFoundError(path)
+        src_st = os.stat(filepath)
+        if width is None:
+            return filepath, src_st, src_st
+        filepath = get_variant(filepath, width, quality)
+        return filepath, os.stat(filepath), src_st
+
+    async def respond(self, writer, status, headers=None, close=False, length=True):
+        # writes the status line and headers. length=True adds an empty body
+        # (errors), the caller sends the body otherwise
+        lines = ["HTTP/1.1 {} {}".format(status, STATUS_TEXT[status])]
+        lines.append("Date: " + email.utils.formatdate(time.time(), usegmt=True))
+        for name, value in (headers or {}).items():
+            lines.append("{}: {}".format(name, value))
+        if length and status != 304:
+            lines.append("Content-Length: 0")
+        if close:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+
+def parse_request(head):
+    # returns method, target, version and the headers (lowercase names) of a
+    # request head, all None if it is malformed
+    try:
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ")
+        headers = {}
+        for line in lines[1:]:
+            if line == "":
+                continue
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    except ValueError:
+        return None, None, None, None
+    return method, target, version, headers
+
+
+def not_modified(headers, etag, mtime):
+    if "if-none-match" in headers:
+        tags = [tag.strip() for tag in headers["if-none-match"].split(",")]
+        return "*" in tags or etag in tags or "W/" + etag in tags
+    if "if-modified-since" in headers:
+        try:
+            since = email.utils.parsedate_to_datetime(headers["if-modified-since"])
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since.timestamp()
+    return False
+
+
+def parse_range(value, size):
+    # (offset, count) of a single "bytes=" range, None to ignore the header
+    # (other units, multiple ranges) and False if it cannot be satisfied
+    unit, _, spec = value.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if start == "":
+            # suffix range, the last <end> bytes
+            count = min(int(end), size)
+            if count <= 0:
+                return False
+            return size - count, count
+        start = int(start)
+        end = size - 1 if end == "" else min(int(end), size - 1)
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, end - start + 1
+
+
+async def serve(host, port, concurrency, workers):
+    image_server = ImageServer(BASE_PATH, concurrency, workers)
+    server = await asyncio.start_server(
+        image_server.handle_connection, host, port, limit=MAX_HEADER_BYTES
+    )
+    print("serving images of", BASE_PATH, "on", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="serve the images of BASE_PATH")
+    parser.add_argument("--host", default=IMAGE_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=IMAGE_SERVER_PORT)
+    parser.add_argument("--concurrency", type=int, default=IMAGE_SERVER_CONCURRENCY)
+    parser.add_argument("--workers", type=int, default=IMAGE_SERVER_WORKERS)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.concurrency, args.workers))
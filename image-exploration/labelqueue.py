@@ -0,0 +1,139 @@
+import atexit
+import json
+import os
+import threading
+
+from sqlitehelper import set_labels, set_flower, set_favorite, check_if_exists
+from configuration import (
+    LABEL_WRITE_BEHIND,
+    LABEL_FLUSH_INTERVAL,
+    LABEL_JOURNAL_PATH,
+)
+
+
+class LabelQueue:
+    # write-behind buffer for set_flower / set_favorite. labels are coalesced
+    # per filename and appended to a journal, so a crashed process replays
+    # them on the next start. a background thread writes them in batches
+    def __init__(self, journal_path, interval):
+        self.journal_path = journal_path
+        self.flushing_path = journal_path + ".flushing"
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flowers = {}
+        self.favorites = {}
+        self.stopped = threading.Event()
+        self._replay()
+        self.journal = open(self.journal_path, "a")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _replay(self):
+        # labels of a flush that did not complete come before newer ones
+        for path in [self.flushing_path, self.journal_path]:
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # torn last line
+                        continue
+                    self._apply(entry)
+        if len(self.flowers) > 0 or len(self.favorites) > 0:
+            print("replaying", len(self.flowers) + len(self.favorites), "labels from", self.journal_path)
+            set_labels(self.flowers, self.favorites)
+            self.flowers, self.favorites = {}, {}
+        for path in [self.flushing_path, self.journal_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _apply(self, entry):
+        if "flower" in entry:
+            self.flowers[entry["filename"]] = entry["flower"]
+        if "favorite" in entry:
+            self.favorites[entry["filename"]] = entry["favorite"]
+
+    def put(self, filename, flower=None, favorite=None):
+        entry = {"filename": filename}
+        if flower is not None:
+            entry["flower"] = flower
+        if favorite is not None:
+            entry["favorite"] = favorite
+        with self.lock:
+            self.journal.write(json.dumps(entry) + "\n")
+            self.journal.flush()
+            self._apply(entry)
+
+    def get_flower(self, filename):
+        # label still waiting in the queue, if any
+        with self.lock:
+            return self.flowers.get(filename)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if len(self.flowers) == 0 and len(self.favorites) == 0:
+                    return
+                flowers, self.flowers = self.flowers, {}
+                favorites, self.favorites = self.favorites, {}
+                self.journal.close()
+                self._rotate_journal()
+                self.journal = open(self.journal_path, "a")
+            try:
+                set_labels(flowers, favorites)
+            except Exception:
+                # keep the labels (newer ones win) and the .flushing journal
+                with self.lock:
+                    self.flowers = {**flowers, **self.flowers}
+                    self.favorites = {**favorites, **self.favorites}
+                raise
+            os.remove(self.flushing_path)
+
+    def _rotate_journal(self):
+        if not os.path.exists(self.flushing_path):
+            os.replace(self.journal_path, self.flushing_path)
+            return
+        # a previous flush failed, keep its entries in front of the new ones
+        with open(self.journal_path) as src, open(self.flushing_path, "a") as dst:
+            dst.write(src.read())
+        os.remove(self.journal_path)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # the labels stay in the .flushing journal and are replayed
+                print("error flushing labels:", e)
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+
+
+label_queue = None
+if LABEL_WRITE_BEHIND:
+    label_queue = LabelQueue(LABEL_JOURNAL_PATH, LABEL_FLUSH_INTERVAL)
+
+
+def store_label(filename, flower=None, favorite=None):
+    if label_queue is not None:
+        label_queue.put(filename, flower=flower, favorite=favorite)
+        return
+    if favorite is not None:
+        set_favorite(filename=filename, favorite=favorite)
+    if flower is not None:
+        set_flower(filename=filename, flower=flower)
+
+
+def get_label(filename):
+    # like check_if_exists, but sees labels that are not written yet
+    if label_queue is not None:
+        flower = label_queue.get_flower(filename)
+        if flower is not None:
+            return True, flower
+    return check_if_exists(filename)
@@ -1,15 +1,29 @@
+import os
+
 from dash import Dash, html, dcc, Input, Output, callback, no_update
 from dash.dependencies import Input, Output, State
 import dash
-from flask import Flask, make_response, send_file
+from flask import Flask, make_response, send_file, jsonify, request, abort
 
 from dash_extensions import Keyboard
 import dash_bootstrap_components as dbc
 from annot import *
 from sqlitehelper import *
-from configuration import BASE_PATH, PORT, HOST
+from configuration import (
+    BASE_PATH,
+    THUMBNAIL_QUALITY,
+    IMAGE_MAX_AGE,
+    IMAGE_SERVER_URL,
+    PORT,
+    HOST,
+    READ_SNAPSHOT,
+    READ_SNAPSHOT_REFRESH_INTERVAL,
+)
 from pages import chart, flowers, overview, annotate
+from thumbnails import get_variant, file_etag
 
+if READ_SNAPSHOT:
+    start_read_snapshot(READ_SNAPSHOT_REFRESH_INTERVAL)
 
 flask_app = Flask(__name__)
 app = Dash(
@@ -44,9 +58,37 @@ CONTENT_STYLE = {
 
 @flask_app.route("/image/<path:path>")
 def return_image(path):
+    # captures (and their variants) never change once written, so responses
+    # are cacheable for good; the validators let the browser revalidate with
+    # a 304 and send_file answers range requests with 206
     filepath = BASE_PATH + path
-    print(filepath)
-    return send_file(filepath, mimetype="image/jpg")
+    width = request.args.get("w", type=int)
+    quality = request.args.get("q", THUMBNAIL_QUALITY, type=int)
+    try:
+        # the validators are those of the original, also for variants
+        st = os.stat(filepath)
+        if width is not None:
+            # resized variant, from the thumbnail cache
+            filepath = get_variant(filepath, width, quality)
+    except FileNotFoundError:
+        abort(404)
+    response = send_file(
+        filepath,
+        mimetype="image/jpeg",
+        etag=file_etag(st, width, quality),
+        last_modified=st.st_mtime,
+        max_age=IMAGE_MAX_AGE,
+        conditional=True,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@flask_app.route("/metrics")
+def return_metrics():
+    # latency histograms and slow calls of the sqlitehelper functions
+    return jsonify(get_metrics())
 
 
 app.layout = html.Div(
@@ -80,6 +122,8 @@ def display_page(pathname, href):
         if pathname.startswith("/annotate"):
             href, pn = href.split("/annotate")
             img_url = href + "/image" + pn
+            if IMAGE_SERVER_URL is not None:
+                img_url = image_url(pn[1:])
             return annotate.get_layout(img_url)
         return flowers.get_layout()
 
@@ -7,12 +7,12 @@ import plotly.express as px
 from annot import *
 from sqlitehelper import *
 import pandas as pd
-from skimage import io
+from imagecache import read_image
 
 
 def get_image(path):
     try:
-        img = io.imread(path)
+        img = read_image(path)
     except:
         return None
 
@@ -206,29 +206,17 @@ def store_annotations(annot_json, annot_type, img_url):
     filename = annot_json["filename"]
     if filename is None:
         return False
-    remove_annotations(filename, annot_type)
-    shape = io.imread(img_url).shape
+    shape = read_image(img_url).shape
     im_width = shape[1]
     im_height = shape[0]
-    if "annotations" in annot_json:
-        if len(annot_json["annotations"]) == 0:
-            return True
-        for annot in annot_json["annotations"]:
-            insert_annotation(
-                filename,
-                annot["id"],
-                annot["cx"],
-                annot["cy"],
-                annot["w"],
-                annot["h"],
-                annot["x0"],
-                annot["y0"],
-                annot["x1"],
-                annot["y1"],
-                im_width,
-                im_height,
-                annot_type,
-            )
+    replace_annotations(
+        filename,
+        annot_type,
+        annot_json.get("annotations", []),
+        im_width,
+        im_height,
+    )
+    return True
 
 
 def get_annotations(filename, annot_type):
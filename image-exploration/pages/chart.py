@@ -96,7 +96,8 @@ def display_hover(hoverData):
     df_row = df.iloc[num]
     img_src = df_row["path"]
 
-    img_src = "/image/" + img_src
+    # the card is 300px wide, 600 keeps it sharp on hidpi screens
+    img_src = image_url(img_src, 600)
     name = df_row["node_id"]
     flower = df_row["flower"]
     flower_text = "Not classified"
@@ -111,7 +112,7 @@ def display_hover(hoverData):
         card_color = "danger"
     date = df_row["date"]
     img_card = None
-    if df_row["available"] == True:
+    if pd.notna(df_row["available"]) and df_row["available"] == 1:
         img_card = dbc.CardImg(src=img_src, bottom=True, style={"padding": "0px"})
 
     children = [
@@ -126,7 +127,7 @@ def display_hover(hoverData):
                             style={"padding": "8px"},
                         ),
                         dbc.CardBody(
-                            html.Small(date, className="card-text text-muted"),
+                            html.Small(str(date), className="card-text text-muted"),
                             style={"padding": "6px"},
                         ),
                         img_card,
@@ -6,11 +6,11 @@ import plotly.express as px
 from annot import *
 from sqlitehelper import *
 import pandas as pd
-from skimage import io
+from imagecache import read_image
 
 
 def get_image(path):
-    img = io.imread(path)
+    img = read_image(path)
     fig = px.imshow(img)
     fig.update_layout(
         dragmode="drawrect",
@@ -171,33 +171,31 @@ def get_annot_json(figure, filename):
         return None
 
 
-def store_annotations(annot_json):
+def store_annotations(annot_json, img_url):
     if annot_json is None:
 
         return False
     filename = annot_json["filename"]
     if filename is None:
         return False
-    remove_annotations(filename, 2)
-    if "annotations" in annot_json:
-        if len(annot_json["annotations"]) == 0:
-            remove_annotations(filename, 2)
-            return True
-        for annot in annot_json["annotations"]:
-            insert_annotation(
-                filename,
-                annot["id"],
-                annot["center_x"],
-                annot["center_y"],
-                annot["w"],
-                annot["h"],
-                annot["x0"],
-                annot["y0"],
-                annot["x1"],
-                annot["y1"],
-                2,
-            )
+    shape = read_image(img_url).shape
+    boxes = [
+        {
+            "id": annot["id"],
+            "cx": annot["center_x"],
+            "cy": annot["center_y"],
+            "w": annot["w"],
+            "h": annot["h"],
+            "x0": annot["x0"],
+            "y0": annot["y0"],
+            "x1": annot["x1"],
+            "y1": annot["y1"],
+        }
+        for annot in annot_json.get("annotations", [])
+    ]
+    replace_annotations(filename, 2, boxes, shape[1], shape[0])
     print(select_annotations(filename))
+    return True
 
 
 def get_annotations(filename):
@@ -319,7 +317,7 @@ def on_button_click(n_clicks, apply_clicks, save_clicks, figure, image_url):
 
                 annot_json = get_annot_json(figure, image_url.split("/")[-1])
                 if annot_json is not None:
-                    store_annotations(annot_json)
+                    store_annotations(annot_json, image_url)
                 return dash.no_update
         else:
             return dash.no_update
@@ -4,10 +4,15 @@ from dash_extensions import Keyboard
 import dash
 from annot import *
 from sqlitehelper import *
-from configuration import BASE_PATH
+from configuration import BASE_PATH, EXPLORER_PREFETCH
+from labelqueue import store_label, get_label
+from thumbnails import warm_variants
 
 imageList = ImageList(BASE_PATH)
 
+# width of the variant shown in the explorer
+IMAGE_WIDTH = 1920
+
 
 layout_right = html.Div(
     [
@@ -49,7 +54,7 @@ layout_right = html.Div(
                 "Open Image in new Tab",
             ],
             id="open_image",
-            href="/image/" + imageList.get_file(),
+            href=image_url(imageList.get_file()),
             external_link=True,
             target="_blank",
             color="info",
@@ -199,6 +204,14 @@ layout_left = html.Div(
             value=[8, 18],
         ),
         html.Br(),
+        html.Label("Date range"),
+        html.Br(),
+        dcc.DatePickerRange(
+            id="date-range",
+            clearable=True,
+            display_format="YYYY-MM-DD",
+        ),
+        html.Br(),
     ]
 )
 
@@ -224,6 +237,8 @@ def get_layout():
                                     ]
                                 ),
                             ),
+                            # hidden images the browser loads ahead of time
+                            html.Div(id="prefetch", style={"display": "none"}),
                             html.Br(),
                         ],
                         width=6,
@@ -362,10 +377,7 @@ def store_flower(flower, no_flower, unknown, nkd, kd, path, fnts):
         text = "Removed from favourite"
     node_id, date = get_metadata_from_filename(path.split("/")[-1])
     filename = path.split("/")[-1]
-    if favourite is not None:
-        set_favorite(filename=filename, favorite=favourite)
-    if flower is not None:
-        set_flower(filename=filename, flower=flower)
+    store_label(filename, flower=flower, favorite=favourite)
 
     return dbc.Alert(
         [html.I(className="bi bi-check-circle-fill me-2"), text], color=col
@@ -376,6 +388,7 @@ def store_flower(flower, no_flower, unknown, nkd, kd, path, fnts):
     Output("filename", "children"),
     Output("current_filename", "data"),
     Output("imagediv", "children"),
+    Output("prefetch", "children"),
     Input("random", "n_clicks"),
     Input("next", "n_clicks"),
     Input("previous", "n_clicks"),
@@ -426,13 +439,20 @@ def update_figure(
         return no_update
 
     node_id, date = get_metadata_from_filename(filename.split("/")[-1])
+    neighbours = imageList.get_neighbours(EXPLORER_PREFETCH)
+    warm_variants(neighbours, IMAGE_WIDTH)
     return (
         "ID: " + node_id + " Date: " + date.strftime("%Y-%m-%d %H:%M:%S"),
         filename,
-        html.Img(src="/image/" + filename, style={"width": "100%"}),
+        html.Img(src=get_image_src(filename), style={"width": "100%"}),
+        [html.Img(src=get_image_src(path)) for path in neighbours],
     )
 
 
+def get_image_src(path):
+    return image_url(path, IMAGE_WIDTH)
+
+
 @callback(
     Output("prev_annot", "children"),
     Output("open_image", "href"),
@@ -444,8 +464,8 @@ def update_figure(
 def check_annotation(modified, filename):
     if filename is None:
         return no_update, no_update, no_update
-    annotated, flower = check_if_exists(filename.split("/")[-1])
-    new_href_img = "/image/" + filename
+    annotated, flower = get_label(filename.split("/")[-1])
+    new_href_img = image_url(filename)
     new_href_annot = "/annotate/" + filename
     if annotated:
         if flower == 1:
@@ -498,10 +518,20 @@ def check_annotation(modified, filename):
     State("radioitems-input", "value"),
     Input("slider", "value"),
     State("slider", "value"),
+    Input("date-range", "start_date"),
+    Input("date-range", "end_date"),
     prevent_initial_callbacks=True,
 )
-def update_selected_node(node_id, radio_input, radio_state, slider_input, slider_state):
-    if node_id is None and radio_input is None and slider_input is None:
+def update_selected_node(
+    node_id, radio_input, radio_state, slider_input, slider_state, start_date, end_date
+):
+    if (
+        node_id is None
+        and radio_input is None
+        and slider_input is None
+        and start_date is None
+        and end_date is None
+    ):
         print("getting filelist without conditions")
         imageList.update_filelist_by_selection()
         if imageList.get_file() is None:
@@ -519,6 +549,8 @@ def update_selected_node(node_id, radio_input, radio_state, slider_input, slider
             seen_unseen_not_sure=radio_state,
             starttime_h=slider_state[0],
             endtime_h=slider_state[1],
+            startdate=start_date,
+            enddate=end_date,
         )
         if imageList.get_file() is None:
             return "No Images for selected filters available", no_update
@@ -1,59 +1,1040 @@
 import sqlite3
+import bisect
+import contextlib
+import copy
 import datetime
+import functools
+import itertools
+import json
+import os
+import pathlib
+import threading
 import time
+from collections import OrderedDict, deque
 import pandas as pd
+from pandas.api.types import union_categoricals
 
-from configuration import DB_PATH
+from configuration import (
+    DB_PATH,
+    READ_CACHE_SIZE,
+    ANALYTICS_BACKEND,
+    SLOW_QUERY_MS,
+    SLOW_QUERY_LOG_PATH,
+    METRICS_WINDOW,
+    ARCHIVE_DIR,
+)
+from filenames import get_metadata_from_filename, get_time_columns, parse_filenames
 
-def create_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS images (
-            filename TEXT PK UNIQUE,
-            path TEXT,
-            node_id TEXT,
-            date datetime,
-            flower int,
-            pollinator int,
-            capture_type int,
-            favorite int,
-            available boolean
-        )
-        """
+# pragmas applied to every connection opened by get_connection()
+# WAL lets the dash readers keep going while update_db writes
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # negative = KiB, i.e. 64 MB page cache
+    "mmap_size": 268435456,  # 256 MB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+    # so INSERT OR REPLACE fires the node_stats delete trigger
+    "recursive_triggers": "ON",
+}
+
+# prepared statements kept per connection, keyed by sql text
+STATEMENT_CACHE_SIZE = 256
+
+# rows fetched per round trip when building dataframes
+FETCH_SIZE = 50000
+
+# filenames parsed per batch during bulk ingest
+PARSE_BATCH_SIZE = 50000
+
+# in-memory databases of the read snapshot, a new one per refresh. each is
+# shared by all connections to it and freed once the last one is closed
+SNAPSHOT_URI = "file:/flower_image_snapshot_{}?vfs=memdb"
+SNAPSHOT_PRAGMAS = {
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+# executemany batches up to this size are mirrored into the read snapshot,
+# larger writes (bulk ingest) reload it instead
+SNAPSHOT_MIRROR_ROWS = 10000
+
+# idle connections kept per database for reuse by other threads
+CONNECTION_POOL_SIZE = 8
+
+_local = threading.local()
+
+# connections are set up once (pragmas, archives, temp views, statement
+# cache) and shared between threads: a thread takes one from the pool on its
+# first query and gives it back when its outermost @instrumented call
+# returns, since flask serves every request on a new thread
+_pool = {}  # database -> idle connections
+_pool_lock = threading.Lock()
+
+
+def _checkout(database):
+    with _pool_lock:
+        idle = _pool.get(database)
+        if idle:
+            return idle.pop()
+    return None
+
+
+def _open_connection(database, pragmas):
+    conn = sqlite3.connect(
+        database,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=_InstrumentedConnection,
+        uri=True,
+        check_same_thread=False,
     )
-    conn.commit()
-    conn.close()
+    conn.database = database
+    with _not_mirrored():
+        for pragma, value in pragmas.items():
+            conn.execute("PRAGMA {} = {}".format(pragma, value))
+        _attach_archives(conn)
+    return conn
 
-def create_annot_table():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS annot (
-            filename TEXT,
-            annot_id int,
-            cx int,
-            cy int,
-            w int,
-            h int,
-            x0 int,
-            y0 int,
-            x1 int,
-            y1 int,
-            image_width int,
-            image_height int,
-            annot_type int
+
+def get_connection():
+    # the connection of this thread, from the pool or opened lazily
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _checkout(DB_PATH) or _open_connection(DB_PATH, PRAGMAS)
+        _local.conn = conn
+    return conn
+
+
+def get_read_connection():
+    # connection used by the readers: the in-memory snapshot when
+    # start_read_snapshot() was called, otherwise the one of get_connection()
+    if _snapshot is None:
+        return get_connection()
+    conn = getattr(_local, "read_conn", None)
+    uri = _snapshot.uri
+    if conn is not None and conn.database != uri:
+        # the snapshot was reloaded into a new database
+        conn.close()
+        conn = None
+    if conn is None:
+        conn = _checkout(uri)
+        if conn is None:
+            conn = _open_connection(uri, SNAPSHOT_PRAGMAS)
+            # after the temp views are created
+            with _not_mirrored():
+                conn.execute("PRAGMA query_only = ON")
+        _local.read_conn = conn
+    return conn
+
+
+def release_connection():
+    # gives the connections of this thread back to the pool, unless they are
+    # in a transaction or of a database no longer in use
+    current = [DB_PATH, None if _snapshot is None else _snapshot.uri]
+    for name in ["conn", "read_conn"]:
+        conn = getattr(_local, name, None)
+        if conn is None or conn.in_transaction:
+            continue
+        setattr(_local, name, None)
+        with _pool_lock:
+            idle = _pool.setdefault(conn.database, [])
+            if conn.database in current and len(idle) < CONNECTION_POOL_SIZE:
+                idle.append(conn)
+                continue
+        conn.close()
+
+
+def close_connection():
+    # closes the connections of this thread and the idle ones, so the next
+    # queries open new connections (e.g. after migrate() or archive_season())
+    for name in ["conn", "read_conn"]:
+        conn = getattr(_local, name, None)
+        if conn is not None:
+            conn.close()
+            setattr(_local, name, None)
+    _close_idle()
+
+
+def _close_idle(database=None):
+    with _pool_lock:
+        databases = list(_pool) if database is None else [database]
+        idle = [conn for d in databases for conn in _pool.pop(d, [])]
+    for conn in idle:
+        conn.close()
+
+
+# read cache: results of @cached_read functions are kept until the write
+# generation changes. @writes bumps it for writes made through this module,
+# PRAGMA data_version catches commits from other connections and processes.
+# data_version is only comparable within one connection, so it is polled on
+# a single process-wide connection rather than on the per-thread ones (flask
+# serves requests on new threads)
+_read_cache = OrderedDict()
+_read_cache_lock = threading.Lock()
+_write_generation = 0
+_version_conn = None
+_version_db_path = None
+_data_version = None
+
+
+def _bump_generation():
+    global _write_generation
+    with _read_cache_lock:
+        _write_generation += 1
+        _read_cache.clear()
+
+
+def _current_generation():
+    global _write_generation, _version_conn, _version_db_path, _data_version
+    with _read_cache_lock:
+        if _version_conn is None or _version_db_path != DB_PATH:
+            if _version_conn is not None:
+                _version_conn.close()
+            _version_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            _version_db_path = DB_PATH
+            _data_version = None
+        data_version = _version_conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != _data_version:
+            # also when the connection was just opened: the DB may have
+            # changed while nothing was polling it
+            _write_generation += 1
+            _read_cache.clear()
+            _data_version = data_version
+        return _write_generation
+
+
+def writes(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # the statements are recorded for the read snapshot, see _TimedCursor
+        mirror = _snapshot is not None and getattr(_local, "mirror", None) is None
+        if mirror:
+            _local.mirror = []
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            statements = getattr(_local, "mirror", None)
+            if mirror:
+                _local.mirror = None
+            _bump_generation()
+        if mirror:
+            _snapshot.mirror(statements)
+        return result
+
+    return wrapper
+
+
+def cached_read(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        generation = _current_generation()
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        with _read_cache_lock:
+            entry = _read_cache.get(key)
+            if entry is not None and entry[0] == generation:
+                _read_cache.move_to_end(key)
+                return _copy_result(entry[1])
+        _local.skip_cache = False
+        result = func(*args, **kwargs)
+        with _read_cache_lock:
+            if generation == _write_generation and not _local.skip_cache:
+                _read_cache[key] = (generation, result)
+                _read_cache.move_to_end(key)
+                while len(_read_cache) > READ_CACHE_SIZE:
+                    _read_cache.popitem(last=False)
+        return _copy_result(result)
+
+    wrapper.uncached = func
+    return wrapper
+
+
+def _skip_cache():
+    # called by a @cached_read function whose result is older than the
+    # current generation (e.g. read from the duckdb copy), so it is returned
+    # but not cached under that generation
+    _local.skip_cache = True
+
+
+def _copy_result(result):
+    # callers modify the dataframes they get (e.g. overview adds columns)
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    return copy.copy(result)
+
+
+# instrumentation: @instrumented records wall time and rows of each call.
+# statements run during the outermost instrumented call of a thread are timed
+# by _TimedCursor (execute and fetches) and recorded by their sql text, which
+# only depends on the filters used since values are bound. calls slower than
+# SLOW_QUERY_MS are logged together with the plans of their slowest statements
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+METRICS_SLOT_SECONDS = 60
+SLOW_QUERIES_KEPT = 50
+
+_metrics_lock = threading.Lock()
+_metrics_slots = deque()  # (slot start, {function: stats}, {sql: stats})
+_slow_queries = deque(maxlen=SLOW_QUERIES_KEPT)
+
+
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        _record_write(sql, parameters, False)
+        self._stat = _start_statement(sql, parameters)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._add_time(t0, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = _record_write(sql, seq_of_parameters, True)
+        self._stat = _start_statement(sql, None)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add_time(t0, max(self.rowcount, 0))
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._add_time(t0, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add_time(t0, len(rows))
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._add_time(t0, len(rows))
+        return rows
+
+    def _add_time(self, t0, rows):
+        stat = getattr(self, "_stat", None)
+        if stat is not None:
+            stat["seconds"] += time.perf_counter() - t0
+            stat["rows"] += rows
+
+
+class _InstrumentedConnection(sqlite3.Connection):
+    # every statement runs on a _TimedCursor, including the execute()
+    # shortcuts, which would otherwise open a plain cursor
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        _record_write(sql_script, None, False)
+        return super().executescript(sql_script)
+
+
+def _record_write(sql, parameters, many):
+    # inside @writes with a read snapshot running, keeps the data changes
+    # so they can be replayed on the snapshot. anything else that changes the
+    # database (schema, temp tables, ATTACH, big batches) marks the write as
+    # not mirrorable, the snapshot is reloaded instead.
+    # returns the parameters, which may have been consumed for executemany
+    mirror = getattr(_local, "mirror", None)
+    if mirror is None:
+        return parameters
+    verb = sql.lstrip().split(None, 1)[0].upper()
+    if verb in ("SELECT", "EXPLAIN") or mirror is False:
+        return parameters
+    if verb not in ("INSERT", "UPDATE", "DELETE", "REPLACE") or parameters is None:
+        _local.mirror = False
+        return parameters
+    if many:
+        parameters = iter(parameters)
+        batch = list(itertools.islice(parameters, SNAPSHOT_MIRROR_ROWS + 1))
+        if len(batch) > SNAPSHOT_MIRROR_ROWS:
+            _local.mirror = False
+            return itertools.chain(batch, parameters)
+        parameters = batch
+    mirror.append((sql, parameters, many))
+    return parameters
+
+
+@contextlib.contextmanager
+def _not_mirrored():
+    # for connection setup that happens to run inside a write
+    mirror = getattr(_local, "mirror", None)
+    _local.mirror = None
+    try:
+        yield
+    finally:
+        _local.mirror = mirror
+
+
+def _start_statement(sql, parameters):
+    calls = getattr(_local, "calls", None)
+    if not calls:
+        return None
+    stat = {"sql": sql, "parameters": parameters, "seconds": 0.0, "rows": 0}
+    calls[0]["statements"].append(stat)
+    return stat
+
+
+@functools.lru_cache(maxsize=1024)
+def _sql_shape(sql):
+    return " ".join(sql.split())
+
+
+def instrumented(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        calls = getattr(_local, "calls", None)
+        if calls is None:
+            calls = _local.calls = []
+        call = {"statements": []}
+        calls.append(call)
+        t0 = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - t0
+            calls.pop()
+            if len(calls) == 0:
+                release_connection()
+        if isinstance(result, (list, pd.DataFrame)):
+            rows = len(result)
+        else:
+            rows = sum(stat["rows"] for stat in call["statements"])
+        _record_call(func.__name__, seconds, rows, call["statements"])
+        if len(calls) == 0 and seconds * 1000 >= SLOW_QUERY_MS:
+            _log_slow_call(func.__name__, seconds, rows, call["statements"])
+        return result
+
+    return wrapper
+
+
+def _record_call(name, seconds, rows, statements):
+    now = time.time()
+    with _metrics_lock:
+        if len(_metrics_slots) == 0 or _metrics_slots[-1][0] + METRICS_SLOT_SECONDS <= now:
+            _metrics_slots.append((now, {}, {}))
+        while _metrics_slots[0][0] + METRICS_SLOT_SECONDS < now - METRICS_WINDOW:
+            _metrics_slots.popleft()
+        slot_start, functions, shapes = _metrics_slots[-1]
+        _add_stats(functions, name, seconds, rows)
+        for stat in statements:
+            _add_stats(shapes, _sql_shape(stat["sql"]), stat["seconds"], stat["rows"])
+
+
+def _add_stats(stats_by_key, key, seconds, rows):
+    stats = stats_by_key.get(key)
+    if stats is None:
+        stats = stats_by_key[key] = {
+            "calls": 0,
+            "rows": 0,
+            "seconds": 0.0,
+            "max_seconds": 0.0,
+            "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        }
+    stats["calls"] += 1
+    stats["rows"] += rows
+    stats["seconds"] += seconds
+    stats["max_seconds"] = max(stats["max_seconds"], seconds)
+    stats["buckets"][bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+
+
+def _log_slow_call(name, seconds, rows, statements, explained=5):
+    slowest = sorted(statements, key=lambda stat: stat["seconds"], reverse=True)
+    entry = {
+        "time": datetime.datetime.now().isoformat(),
+        "function": name,
+        "ms": round(seconds * 1000, 1),
+        "rows": rows,
+        "statements": [
+            {
+                "sql": _sql_shape(stat["sql"]),
+                "ms": round(stat["seconds"] * 1000, 1),
+                "rows": stat["rows"],
+                "plan": _explain(stat["sql"], stat["parameters"]),
+            }
+            for stat in slowest[:explained]
+        ],
+    }
+    _slow_queries.append(entry)
+    print("slow call: {} took {:.0f} ms, {} rows".format(name, entry["ms"], rows))
+    if SLOW_QUERY_LOG_PATH is not None:
+        with open(SLOW_QUERY_LOG_PATH, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+
+
+def _explain(sql, parameters):
+    # parameters are not kept for executemany, the plan does not depend on them
+    if parameters is None:
+        parameters = [None] * sql.count("?")
+    try:
+        rows = get_connection().execute("EXPLAIN QUERY PLAN " + sql, parameters)
+        return [row[3] for row in rows]
+    except sqlite3.Error:
+        return None
+
+
+def get_metrics():
+    # latency histograms of the instrumented calls and of their statements
+    # over the last METRICS_WINDOW seconds, plus the latest slow calls
+    since = time.time() - METRICS_WINDOW
+    functions = {}
+    shapes = {}
+    with _metrics_lock:
+        for slot_start, slot_functions, slot_shapes in _metrics_slots:
+            if slot_start + METRICS_SLOT_SECONDS < since:
+                continue
+            for merged, slot in [(functions, slot_functions), (shapes, slot_shapes)]:
+                for key, stats in slot.items():
+                    total = merged.get(key)
+                    if total is None:
+                        merged[key] = copy.deepcopy(stats)
+                        continue
+                    total["calls"] += stats["calls"]
+                    total["rows"] += stats["rows"]
+                    total["seconds"] += stats["seconds"]
+                    total["max_seconds"] = max(total["max_seconds"], stats["max_seconds"])
+                    total["buckets"] = [a + b for a, b in zip(total["buckets"], stats["buckets"])]
+        slow = list(_slow_queries)
+    return {
+        "window_seconds": METRICS_WINDOW,
+        "buckets_ms": LATENCY_BUCKETS_MS + ["inf"],
+        "functions": {name: _summary(stats) for name, stats in sorted(functions.items())},
+        "statements": sorted(
+            [dict(_summary(stats), sql=sql) for sql, stats in shapes.items()],
+            key=lambda summary: summary["total_ms"],
+            reverse=True,
+        ),
+        "slow": slow,
+    }
+
+
+def _summary(stats):
+    summary = {
+        "calls": stats["calls"],
+        "rows": stats["rows"],
+        "total_ms": round(stats["seconds"] * 1000, 1),
+        "mean_ms": round(stats["seconds"] * 1000 / stats["calls"], 2),
+        "max_ms": round(stats["max_seconds"] * 1000, 1),
+        "histogram": stats["buckets"],
+    }
+    for q in [50, 95, 99]:
+        # upper bound of the bucket holding the quantile
+        rank = stats["calls"] * q / 100
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + [None], stats["buckets"]):
+            seen += count
+            if seen >= rank:
+                break
+        summary["p{}_ms".format(q)] = bound if bound is not None else summary["max_ms"]
+    return summary
+
+
+# read snapshot: an in-memory copy of DB_PATH for the dash app, see
+# READ_SNAPSHOT in configuration. readers use get_read_connection(), the
+# changes made by @writes functions are replayed on the copy right after
+# they were committed to disk
+_snapshot = None
+
+
+class ReadSnapshot:
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.disk = sqlite3.connect(DB_PATH, check_same_thread=False)
+        self.memory = None  # connection the writes are mirrored through
+        self.uri = None
+        self.loads = 0
+        self.data_version = None
+        self.refresh()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def refresh(self):
+        t0 = time.time()
+        with self.lock:
+            self.data_version = self.disk.execute("PRAGMA data_version").fetchone()[0]
+            # DB_PATH is copied into a new database, the readers switch over
+            # and free the old one. a backup would carry over the WAL flag of
+            # DB_PATH (header bytes 18 and 19), which memdb databases cannot
+            # open, VACUUM INTO writes a rollback journal database instead
+            self.loads += 1
+            uri = SNAPSHOT_URI.format(self.loads)
+            memory = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self.disk.execute("VACUUM INTO ?", (uri,))
+            # same as PRAGMAS, for replayed INSERT OR REPLACE
+            memory.execute("PRAGMA recursive_triggers = ON")
+            if self.memory is not None:
+                self.memory.close()
+            self.memory = memory
+            old_uri, self.uri = self.uri, uri
+        if old_uri is not None:
+            # lets the old database go once the readers are done with it
+            _close_idle(old_uri)
+        _bump_generation()
+        print("read snapshot loaded in {:.2f}s".format(time.time() - t0))
+
+    def mirror(self, statements):
+        # statements as recorded by _record_write, False if not mirrorable
+        if statements:
+            try:
+                with self.lock, self.memory:
+                    for sql, parameters, many in statements:
+                        if many:
+                            self.memory.executemany(sql, parameters)
+                        else:
+                            self.memory.execute(sql, parameters)
+                    # the write is in the snapshot now, so _run only reloads
+                    # for changes made elsewhere. a commit of another process
+                    # just before this is only picked up by its next change
+                    self.data_version = self.disk.execute(
+                        "PRAGMA data_version"
+                    ).fetchone()[0]
+                return
+            except sqlite3.Error as e:
+                print("read snapshot out of sync, reloading:", e)
+        if statements is False or len(statements) > 0:
+            self.refresh()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                data_version = self.disk.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self.data_version:
+                    self.refresh()
+            except sqlite3.Error as e:
+                print("read snapshot refresh failed:", e)
+
+
+def start_read_snapshot(refresh_interval):
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = ReadSnapshot(refresh_interval)
+    return _snapshot
+
+
+# column dtypes of the dataframes built by _load_df
+IMAGE_DTYPES = [
+    ("filename", "object"),
+    ("path", "object"),
+    ("node_id", "category"),
+    ("date", "datetime"),
+    ("flower", "Int8"),
+    ("pollinator", "Int8"),
+    ("capture_type", "Int8"),
+    ("favorite", "Int8"),
+    ("available", "Int8"),
+]
+ANNOT_DTYPES = [
+    ("filename", "object"),
+    ("annot_id", "Int32"),
+    ("cx", "Int32"),
+    ("cy", "Int32"),
+    ("w", "Int32"),
+    ("h", "Int32"),
+    ("x0", "Int32"),
+    ("y0", "Int32"),
+    ("x1", "Int32"),
+    ("y1", "Int32"),
+    ("image_width", "Int32"),
+    ("image_height", "Int32"),
+    ("annot_type", "Int8"),
+]
+
+
+def _load_df(cursor, dtypes):
+    # builds a dataframe per chunk of rows and converts it to the final dtypes
+    # right away, so the python objects of a chunk are freed before the next
+    # one is fetched
+    names = [name for name, dtype in dtypes]
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if len(rows) == 0:
+            break
+        # object columns, without inferring a type from the values first
+        df = pd.DataFrame(rows, columns=names, dtype="object")
+        chunks.append(_cast_df(df, dtypes))
+    if len(chunks) == 0:
+        return _cast_df(pd.DataFrame(columns=names, dtype="object"), dtypes)
+    df = pd.concat(chunks, ignore_index=True)
+    for name, dtype in dtypes:
+        if dtype == "category":
+            # the chunks have different categories, concat falls back to object
+            df[name] = union_categoricals(
+                [chunk[name] for chunk in chunks], sort_categories=True
+            )
+    return df
+
+
+def _cast_df(df, dtypes):
+    # converts the columns of df to the dtypes of _load_df, also used for
+    # dataframes that were built elsewhere (duckdb)
+    columns = {}
+    for name, dtype in dtypes:
+        column = df[name]
+        if dtype == "datetime":
+            column = pd.to_datetime(column, format="%Y-%m-%d %H:%M:%S")
+        elif dtype == "object" or dtype == "category":
+            column = column.astype(dtype)
+        else:
+            if column.dtype == "object":
+                # python ints and None, astype only takes them via float64
+                column = column.astype("float64")
+            column = column.astype(dtype)
+        columns[name] = column
+    return pd.DataFrame(columns)
+
+
+# schema migrations, applied in order by migrate()
+# the version reached is stored in PRAGMA user_version
+MIGRATIONS = [
+    # 1: initial schema
+    """
+    CREATE TABLE IF NOT EXISTS images (
+        filename TEXT PK UNIQUE,
+        path TEXT,
+        node_id TEXT,
+        date datetime,
+        flower int,
+        pollinator int,
+        capture_type int,
+        favorite int,
+        available boolean
+    );
+    CREATE TABLE IF NOT EXISTS annot (
+        filename TEXT,
+        annot_id int,
+        cx int,
+        cy int,
+        w int,
+        h int,
+        x0 int,
+        y0 int,
+        x1 int,
+        y1 int,
+        image_width int,
+        image_height int,
+        annot_type int
+    );
+    """,
+    # 2: real primary key on images.filename, indexes for the page queries
+    """
+    CREATE TABLE images_new (
+        filename TEXT PRIMARY KEY NOT NULL,
+        path TEXT,
+        node_id TEXT,
+        date datetime,
+        flower int,
+        pollinator int,
+        capture_type int,
+        favorite int,
+        available boolean
+    );
+    INSERT OR IGNORE INTO images_new
+        SELECT filename, path, node_id, date, flower, pollinator, capture_type, favorite, available
+        FROM images WHERE filename IS NOT NULL;
+    DROP TABLE images;
+    ALTER TABLE images_new RENAME TO images;
+    CREATE INDEX idx_images_node_date ON images (node_id, date);
+    CREATE INDEX idx_images_available_node_date ON images (available, node_id, date);
+    CREATE INDEX idx_images_node_flower ON images (node_id, flower);
+    CREATE INDEX idx_images_date ON images (date);
+    CREATE INDEX idx_annot_filename_type ON annot (filename, annot_type);
+    CREATE INDEX idx_annot_type_filename ON annot (annot_type, filename);
+    """,
+    # 3: scan manifest for incremental rescans, index on the directory of each image
+    """
+    CREATE TABLE scan_manifest (
+        dir TEXT PRIMARY KEY NOT NULL,
+        parent TEXT,
+        mtime_ns int,
+        entry_count int,
+        scanned_at datetime
+    );
+    CREATE INDEX idx_scan_manifest_parent ON scan_manifest (parent);
+    CREATE INDEX idx_images_dir ON images (substr(path, 1, length(path) - length(filename) - 1));
+    """,
+    # 4: indexed time of day and epoch seconds next to date
+    """
+    ALTER TABLE images ADD COLUMN minute_of_day int;
+    ALTER TABLE images ADD COLUMN epoch int;
+    UPDATE images SET
+        minute_of_day = CAST(strftime('%H', date) AS int) * 60 + CAST(strftime('%M', date) AS int),
+        epoch = CAST(strftime('%s', date) AS int);
+    CREATE INDEX idx_images_available_node_minute ON images (available, node_id, minute_of_day);
+    CREATE INDEX idx_images_available_node_epoch ON images (available, node_id, epoch);
+    CREATE INDEX idx_images_available_minute ON images (available, minute_of_day);
+    CREATE INDEX idx_images_available_epoch ON images (available, epoch);
+    """,
+    # 5: per-node counters kept current by triggers
+    """
+    CREATE TABLE node_stats (
+        node_id TEXT PRIMARY KEY NOT NULL,
+        count_images int NOT NULL DEFAULT 0,
+        count_classified int NOT NULL DEFAULT 0,
+        count_flower int NOT NULL DEFAULT 0,
+        count_not_sure int NOT NULL DEFAULT 0,
+        count_no_flower int NOT NULL DEFAULT 0,
+        count_available int NOT NULL DEFAULT 0
+    );
+    INSERT INTO node_stats
+        SELECT node_id,
+            count(*),
+            count(flower),
+            count(case flower when 1 then 1 else null end),
+            count(case flower when 0 then 1 else null end),
+            count(case flower when -1 then 1 else null end),
+            count(case when available then 1 else null end)
+        FROM images WHERE node_id IS NOT NULL GROUP BY node_id;
+    CREATE TRIGGER node_stats_insert AFTER INSERT ON images
+    BEGIN
+        INSERT OR IGNORE INTO node_stats (node_id) VALUES (NEW.node_id);
+        UPDATE node_stats SET
+            count_images = count_images + 1,
+            count_classified = count_classified + (NEW.flower IS NOT NULL),
+            count_flower = count_flower + (NEW.flower IS 1),
+            count_not_sure = count_not_sure + (NEW.flower IS 0),
+            count_no_flower = count_no_flower + (NEW.flower IS -1),
+            count_available = count_available + (NEW.available IS 1)
+        WHERE node_id = NEW.node_id;
+    END;
+    CREATE TRIGGER node_stats_delete AFTER DELETE ON images
+    BEGIN
+        UPDATE node_stats SET
+            count_images = count_images - 1,
+            count_classified = count_classified - (OLD.flower IS NOT NULL),
+            count_flower = count_flower - (OLD.flower IS 1),
+            count_not_sure = count_not_sure - (OLD.flower IS 0),
+            count_no_flower = count_no_flower - (OLD.flower IS -1),
+            count_available = count_available - (OLD.available IS 1)
+        WHERE node_id = OLD.node_id;
+    END;
+    CREATE TRIGGER node_stats_update AFTER UPDATE OF node_id, flower, available ON images
+    BEGIN
+        UPDATE node_stats SET
+            count_images = count_images - 1,
+            count_classified = count_classified - (OLD.flower IS NOT NULL),
+            count_flower = count_flower - (OLD.flower IS 1),
+            count_not_sure = count_not_sure - (OLD.flower IS 0),
+            count_no_flower = count_no_flower - (OLD.flower IS -1),
+            count_available = count_available - (OLD.available IS 1)
+        WHERE node_id = OLD.node_id;
+        INSERT OR IGNORE INTO node_stats (node_id) VALUES (NEW.node_id);
+        UPDATE node_stats SET
+            count_images = count_images + 1,
+            count_classified = count_classified + (NEW.flower IS NOT NULL),
+            count_flower = count_flower + (NEW.flower IS 1),
+            count_not_sure = count_not_sure + (NEW.flower IS 0),
+            count_no_flower = count_no_flower + (NEW.flower IS -1),
+            count_available = count_available + (NEW.available IS 1)
+        WHERE node_id = NEW.node_id;
+    END;
+    """,
+    # 6: one row per box, keep the latest of duplicated boxes
+    """
+    DELETE FROM annot WHERE rowid NOT IN (
+        SELECT max(rowid) FROM annot GROUP BY filename, annot_type, annot_id
+    );
+    DROP INDEX idx_annot_filename_type;
+    CREATE UNIQUE INDEX idx_annot_filename_type_id ON annot (filename, annot_type, annot_id);
+    """,
+]
+
+
+def get_schema_version():
+    conn = get_connection()
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _split_statements(script):
+    # statements of a migration script, triggers stay in one piece
+    statements = []
+    start = 0
+    for i, c in enumerate(script):
+        if c == ";" and sqlite3.complete_statement(script[start : i + 1]):
+            statements.append(script[start : i + 1].strip())
+            start = i + 1
+    return statements
+
+
+@instrumented
+@writes
+def migrate():
+    conn = get_connection()
+    version = get_schema_version()
+    outdated = version < len(MIGRATIONS)
+    while version < len(MIGRATIONS):
+        # user_version is read again once the write lock is held, so of two
+        # processes starting at the same time (the dash app and update_db.py)
+        # only the first applies a step. executescript would commit early
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = get_schema_version()
+            if version < len(MIGRATIONS):
+                version += 1
+                print("migrating database", DB_PATH, "to schema version", version)
+                for statement in _split_statements(MIGRATIONS[version - 1]):
+                    conn.execute(statement)
+                conn.execute("PRAGMA user_version = {}".format(version))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    if outdated:
+        conn.execute("ANALYZE")
+        close_connection()
+    return get_schema_version()
+
+
+# seasonal partitions: archive_season() moves the images of a past season
+# (calendar year) into ARCHIVE_DIR/season_<year>.db. the archives are
+# attached read-only as season_<year>; queries read the active season in
+# main.images unless they ask for the all_images view, a UNION ALL over main
+# and all archives. labels of archived images can no longer be changed
+IMAGE_COLUMNS = "filename, path, node_id, date, flower, pollinator, capture_type, favorite, available, minute_of_day, epoch"
+
+ARCHIVE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.images (
+        filename TEXT PRIMARY KEY NOT NULL,
+        path TEXT,
+        node_id TEXT,
+        date datetime,
+        flower int,
+        pollinator int,
+        capture_type int,
+        favorite int,
+        available boolean,
+        minute_of_day int,
+        epoch int
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_images_node_date ON images (node_id, date)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_images_date ON images (date)",
+]
+
+
+def _archive_path(year):
+    return os.path.join(ARCHIVE_DIR, "season_{}.db".format(year))
+
+
+def get_archived_seasons():
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    years = []
+    for name in os.listdir(ARCHIVE_DIR):
+        if name.startswith("season_") and name.endswith(".db"):
+            years.append(int(name[len("season_"):-len(".db")]))
+    return sorted(years)
+
+
+def _max_attached(conn):
+    # SQLITE_MAX_ATTACHED, 10 unless sqlite was compiled with another limit
+    if hasattr(conn, "getlimit"):
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    return 10
+
+
+def _attach_archives(conn):
+    years = get_archived_seasons()
+    if len(years) > _max_attached(conn):
+        raise RuntimeError(
+            "{} archived seasons in {}, but sqlite attaches at most {} "
+            "databases".format(len(years), ARCHIVE_DIR, _max_attached(conn))
+        )
+    schemas = []
+    for year in years:
+        uri = pathlib.Path(_archive_path(year)).resolve().as_uri() + "?mode=ro"
+        conn.execute("ATTACH DATABASE ? AS season_{}".format(year), (uri,))
+        schemas.append("season_{}".format(year))
+    if conn.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+        # the views need the current schema, migrate() reopens the connection
+        return
+    conn.execute(
+        "CREATE TEMP VIEW IF NOT EXISTS all_images AS "
+        + " UNION ALL ".join(
+            "SELECT {} FROM {}.images".format(IMAGE_COLUMNS, schema)
+            for schema in ["main"] + schemas
         )
-        """
     )
-    conn.commit()
-    conn.close()
+    # filenames that must not be ingested into the active season again
+    conn.execute(
+        "CREATE TEMP VIEW IF NOT EXISTS archived_images AS "
+        + " UNION ALL ".join(
+            ["SELECT filename FROM main.images WHERE 0"]
+            + ["SELECT filename FROM {}.images".format(schema) for schema in schemas]
+        )
+    )
+
+
+def _images_table(include_archive):
+    return "all_images" if include_archive else "images"
+
+
+@instrumented
+@writes
+def archive_season(year):
+    # moves the images dated in year from DB_PATH to the season's archive.
+    # rows are copied before they are deleted, so an interrupted run leaves
+    # them in both databases and running it again finishes the move.
+    # connections of other threads and processes see the archive once reopened
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    start = get_time_columns(datetime.datetime(year, 1, 1))[1]
+    end = get_time_columns(datetime.datetime(year + 1, 1, 1))[1]
+    # ATTACH is not allowed inside a transaction
+    close_connection()
+    conn = get_connection()
+    seasons = get_archived_seasons()
+    if year in seasons:
+        # archived before, attached read-only by get_connection()
+        conn.execute("DETACH DATABASE season_{}".format(year))
+    elif len(seasons) + 1 > _max_attached(conn):
+        raise RuntimeError(
+            "cannot archive season {}: {} seasons are archived already and "
+            "sqlite attaches at most {} databases".format(
+                year, len(seasons), _max_attached(conn)
+            )
+        )
+    conn.execute("ATTACH DATABASE ? AS archive", (_archive_path(year),))
+    try:
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement.format(schema="archive"))
+        with conn:
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO archive.images ({0})
+                SELECT {0} FROM main.images WHERE epoch >= ? AND epoch < ?
+                """.format(IMAGE_COLUMNS),
+                (start, end),
+            )
+            moved = conn.execute(
+                """
+                DELETE FROM main.images
+                WHERE epoch >= ? AND epoch < ?
+                AND filename IN (SELECT filename FROM archive.images)
+                """,
+                (start, end),
+            ).rowcount
+    finally:
+        conn.execute("DETACH DATABASE archive")
+    # reopen so the new archive is attached read-only
+    close_connection()
+    print("archived", moved, "images of season", year, "to", _archive_path(year))
+    return moved
 
 
+@instrumented
 def get_annotated_filenames(annot_type=2):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute(
         """
@@ -61,119 +1042,74 @@ def get_annotated_filenames(annot_type=2):
         """, (annot_type,),
     )
     data = c.fetchall()
-    conn.close()
     if len(data) > 0:
         return data
     return None
 
 
 
+@instrumented
 def get_all_annotations(annot_type=2):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute(
         """
-        SELECT * FROM annot where annot_type = ?
+        SELECT filename, annot_id, cx, cy, w, h, x0, y0, x1, y1, image_width, image_height, annot_type FROM annot where annot_type = ?
         """, (annot_type,),
     )
-    data = c.fetchall()
-    conn.close()
-    if len(data) > 0:
-        df = pd.DataFrame(
-            data,
-            columns=[
-                "filename",
-                "annot_id",
-                "cx",
-                "cy",
-                "w",
-                "h",
-                "x0",
-                "y0",
-                "x1",
-                "y1",
-                "image_width",
-                "image_height",
-                "annot_type",
-            ],
-        )
+    df = _load_df(c, ANNOT_DTYPES)
+    if len(df) > 0:
         return df
     return None
 
-create_db()
-create_annot_table()
+migrate()
 
+@instrumented
 def select_annotations(filename, annot_type = None):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_read_connection()
     c = conn.cursor()
     if annot_type is None:
         c.execute(
             """
-            SELECT * FROM annot WHERE filename = ?
+            SELECT filename, annot_id, cx, cy, w, h, x0, y0, x1, y1, image_width, image_height, annot_type FROM annot WHERE filename = ?
             """,
             (filename,),
         )
     else:
         c.execute(
             """
-            SELECT * FROM annot WHERE filename = ? and annot_type = ?
+            SELECT filename, annot_id, cx, cy, w, h, x0, y0, x1, y1, image_width, image_height, annot_type FROM annot WHERE filename = ? and annot_type = ?
             """,
             (filename, annot_type),
         )
-    data = c.fetchall()
-    conn.close()
-    if len(data) > 0:
-        df = pd.DataFrame(
-            data,
-            columns=[
-                "filename",
-                "annot_id",
-                "cx",
-                "cy",
-                "w",
-                "h",
-                "x0",
-                "y0",
-                "x1",
-                "y1",
-                "image_width",
-                "image_height",
-                "annot_type",
-            ],
-        )
+    df = _load_df(c, ANNOT_DTYPES)
+    if len(df) > 0:
         return df
     return None
 
-def get_all_data_as_df():
-    conn = sqlite3.connect(DB_PATH)
+@instrumented
+@cached_read
+def get_all_data_as_df(include_archive=False):
+    if ANALYTICS_BACKEND == "duckdb" and not include_archive:
+        import analytics
+
+        return analytics.get_all_data_as_df()
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute(
         """
-        SELECT * FROM images order by date desc
-        """
+        SELECT filename, path, node_id, date, flower, pollinator, capture_type, favorite, available FROM {} order by date desc
+        """.format(_images_table(include_archive))
     )
-    data = c.fetchall()
-    conn.close()
-    if len(data) > 0:
-        df = pd.DataFrame(
-            data,
-            columns=[
-                "filename",
-                "path",
-                "node_id",
-                "date",
-                "flower",
-                "pollinator",
-                "capture_type",
-                "favorite",
-                "available",
-            ],
-        )
+    df = _load_df(c, IMAGE_DTYPES)
+    if len(df) > 0:
         return df
     return None
 
+@instrumented
+@writes
 def insert_annotation(filename, annot_id, cx, cy, w, h, x0, y0, x1, y1,image_width, image_height, annot_type=1):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute(
         """
@@ -184,10 +1120,50 @@ def insert_annotation(filename, annot_id, cx, cy, w, h, x0, y0, x1, y1,image_wid
         (filename, annot_id, cx, cy, w, h, x0, y0, x1, y1,image_width, image_height, annot_type),
     )
     conn.commit()
-    conn.close()
 
+@instrumented
+@writes
+def replace_annotations(filename, annot_type, boxes, image_width=None, image_height=None):
+    # replaces all boxes of one annot_type on an image in a single transaction.
+    # boxes are dicts with id, cx, cy, w, h, x0, y0, x1, y1
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            """
+            DELETE FROM annot WHERE filename = ? and annot_type = ?
+            """,
+            (filename, annot_type),
+        )
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO annot (filename, annot_id, cx, cy, w, h, x0, y0, x1, y1, image_width, image_height, annot_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    filename,
+                    box["id"],
+                    box["cx"],
+                    box["cy"],
+                    box["w"],
+                    box["h"],
+                    box["x0"],
+                    box["y0"],
+                    box["x1"],
+                    box["y1"],
+                    image_width,
+                    image_height,
+                    annot_type,
+                )
+                for box in boxes
+            ),
+        )
+
+
+@instrumented
+@writes
 def remove_annotations(filename, annot_type):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     if annot_type is None:
         c.execute(
@@ -204,32 +1180,36 @@ def remove_annotations(filename, annot_type):
             (filename, annot_type),
         )
     conn.commit()
-    conn.close()
 
+@instrumented
+@writes
 def insert_from_list(filenames):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     i = 0
     t0 = time.time()
     for filename in filenames:
         node_id, date = get_metadata_from_filename(filename)
+        minute_of_day, epoch = get_time_columns(date)
         c.execute(
             """
-                INSERT OR IGNORE INTO images (filename, path, node_id, date,flower, pollinator, capture_type, favorite, available)
-                VALUES (?, ?, ?, ?,?,?,?,?,?)
+                INSERT OR IGNORE INTO images (filename, path, node_id, date,flower, pollinator, capture_type, favorite, available, minute_of_day, epoch)
+                VALUES (?, ?, ?, ?,?,?,?,?,?,?,?)
                 
                 """,
-            (filename.split("/")[-1], filename, node_id, date, None, None, None, None, True),
+            (filename.split("/")[-1], filename, node_id, date, None, None, None, None, True, minute_of_day, epoch),
         )
 
         i += 1
         if i % 1000 == 0:
             conn.commit()
             print(time.time() - t0, i, filename)
-    conn.close()
+    conn.commit()
 
+@instrumented
+@writes
 def set_available_from_list(filenames):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     i = 0
     t0 = time.time()
@@ -244,35 +1224,207 @@ def set_available_from_list(filenames):
         if i % 100 == 0:
             conn.commit()
             print(time.time() - t0, i, filename)
-    conn.close()
+    conn.commit()
 
-def get_categorized_as_df():
-    conn = sqlite3.connect(DB_PATH)
+@instrumented
+@writes
+def bulk_ingest(paths, full_sync=True, changed_dirs=None):
+    # loads the scanned relative paths into a temp staging table and applies
+    # inserts / availability flags set-based, all in one transaction.
+    # with full_sync, images not present in the scan are marked unavailable.
+    # with changed_dirs, only images inside those directories are considered
+    # for being marked unavailable (used by the incremental rescan). it may be
+    # a callable, evaluated after paths has been consumed
+    conn = get_connection()
     c = conn.cursor()
+    t0 = time.time()
     c.execute(
         """
-        SELECT * FROM images where flower is not null
+        CREATE TEMP TABLE IF NOT EXISTS scan_staging (
+            filename TEXT PRIMARY KEY NOT NULL,
+            path TEXT,
+            node_id TEXT,
+            date datetime,
+            minute_of_day int,
+            epoch int
+        )
         """
     )
-    data = c.fetchall()
-    conn.close()
-    df = pd.DataFrame(
-        data,
-        columns=[
-            "filename",
-            "path",
-            "node_id",
-            "date",
-            "flower",
-            "pollinator",
-            "capture_type",
-            "favorite",
-            "available",
-        ],
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS scan_dirs (dir TEXT PRIMARY KEY)")
+    with conn:
+        c.execute("DELETE FROM scan_staging")
+        c.execute("DELETE FROM scan_dirs")
+        c.executemany(
+            """
+            INSERT OR IGNORE INTO scan_staging (filename, path, node_id, date, minute_of_day, epoch)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            _staging_rows(paths),
+        )
+        scanned = c.execute("SELECT count(*) FROM scan_staging").fetchone()[0]
+        c.execute(
+            """
+            INSERT OR IGNORE INTO images (filename, path, node_id, date, minute_of_day, epoch, available)
+            SELECT filename, path, node_id, date, minute_of_day, epoch, true FROM scan_staging
+            WHERE filename NOT IN (SELECT filename FROM archived_images)
+            """
+        )
+        inserted = c.rowcount
+        c.execute(
+            """
+            UPDATE images SET available = true
+            WHERE available IS NOT true
+            AND filename IN (SELECT filename FROM scan_staging)
+            """
+        )
+        available = c.rowcount
+        unavailable = 0
+        if changed_dirs is not None:
+            if callable(changed_dirs):
+                changed_dirs = changed_dirs()
+            c.executemany(
+                "INSERT OR IGNORE INTO scan_dirs (dir) VALUES (?)",
+                ((d,) for d in changed_dirs),
+            )
+            c.execute(
+                """
+                UPDATE images SET available = false
+                WHERE substr(path, 1, length(path) - length(filename) - 1) IN (SELECT dir FROM scan_dirs)
+                AND available IS NOT false
+                AND filename NOT IN (SELECT filename FROM scan_staging)
+                """
+            )
+            unavailable = c.rowcount
+        elif full_sync:
+            c.execute(
+                """
+                UPDATE images SET available = false
+                WHERE available IS NOT false
+                AND filename NOT IN (SELECT filename FROM scan_staging)
+                """
+            )
+            unavailable = c.rowcount
+        c.execute("DELETE FROM scan_staging")
+        c.execute("DELETE FROM scan_dirs")
+    seconds = time.time() - t0
+    print(
+        "ingested {} files in {:.1f}s ({:.0f} rows/s): {} new, {} available again, {} unavailable".format(
+            scanned, seconds, scanned / max(seconds, 1e-9), inserted, available, unavailable
+        )
     )
-    return df
+    return {
+        "scanned": scanned,
+        "inserted": inserted,
+        "available": available,
+        "unavailable": unavailable,
+        "seconds": seconds,
+    }
+
+
+def _staging_rows(paths):
+    # parses the paths in batches with the vectorized parser
+    paths = iter(paths)
+    while True:
+        batch = list(itertools.islice(paths, PARSE_BATCH_SIZE))
+        if len(batch) == 0:
+            break
+        df = parse_filenames(batch)
+        yield from zip(
+            df["filename"],
+            df["path"],
+            df["node_id"],
+            df["date"],
+            df["minute_of_day"].tolist(),
+            df["epoch"].tolist(),
+        )
+
+
+def _to_epoch(value, end_of_day=False):
+    # accepts dates, datetimes and their iso strings (as sent by dcc.DatePickerRange)
+    if isinstance(value, str):
+        if len(value) == 10:
+            value = datetime.date.fromisoformat(value)
+        else:
+            value = datetime.datetime.fromisoformat(value)
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(
+            value, datetime.time.max if end_of_day else datetime.time.min
+        )
+    return get_time_columns(value)[1]
+
+
+@instrumented
+@writes
+def set_unavailable_from_list(filenames):
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            """
+            UPDATE images SET available = false WHERE filename = ?
+            """,
+            ((filename.split("/")[-1],) for filename in filenames),
+        )
+
+
+@instrumented
+def get_scan_manifest():
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        """
+        SELECT dir, parent, mtime_ns, entry_count FROM scan_manifest
+        """
+    )
+    data = c.fetchall()
+    return {row[0]: row[1:] for row in data}
 
 
+@instrumented
+def save_scan_manifest(entries, removed_dirs=()):
+    # entries: {dir: (parent, mtime_ns, entry_count)}
+    conn = get_connection()
+    now = datetime.datetime.now()
+    with conn:
+        conn.executemany(
+            """
+            DELETE FROM scan_manifest WHERE dir = ?
+            """,
+            ((d,) for d in removed_dirs),
+        )
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO scan_manifest (dir, parent, mtime_ns, entry_count, scanned_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            ((d, e[0], e[1], e[2], now) for d, e in entries.items()),
+        )
+
+
+@instrumented
+def clear_scan_manifest():
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM scan_manifest")
+
+
+@instrumented
+@cached_read
+def get_categorized_as_df(include_archive=False):
+    if ANALYTICS_BACKEND == "duckdb" and not include_archive:
+        import analytics
+
+        return analytics.get_categorized_as_df()
+    conn = get_read_connection()
+    c = conn.cursor()
+    c.execute(
+        """
+        SELECT filename, path, node_id, date, flower, pollinator, capture_type, favorite, available FROM {} where flower is not null
+        """.format(_images_table(include_archive))
+    )
+    return _load_df(c, IMAGE_DTYPES)
+
+@instrumented
+@writes
 def insert_data(
     filename,
     path,
@@ -283,30 +1435,30 @@ def insert_data(
     capture_type=None,
     favourite=None,
 ):
-    conn = sqlite3.connect(DB_PATH)
+    minute_of_day, epoch = get_time_columns(date)
+    conn = get_connection()
     c = conn.cursor()
     c.execute(
         """
-        INSERT OR REPLACE INTO images (filename, path, node_id, date,  flower, pollinator, capture_type, favorite)
-        VALUES (?, ?, ?, ?,?,?,?,?)
+        INSERT OR REPLACE INTO images (filename, path, node_id, date,  flower, pollinator, capture_type, favorite, minute_of_day, epoch)
+        VALUES (?, ?, ?, ?,?,?,?,?,?,?)
         
         """,
-        (filename, path, node_id, date, flower, pollinator, capture_type, favourite),
+        (filename, path, node_id, date, flower, pollinator, capture_type, favourite, minute_of_day, epoch),
     )
     conn.commit()
-    conn.close()
 
 
+@instrumented
 def get_data():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute(
         """
-        SELECT * FROM images order by date desc
+        SELECT filename, path, node_id, date, flower, pollinator, capture_type, favorite, available FROM images order by date desc
         """
     )
     data = c.fetchall()
-    conn.close()
     return data
 
 
@@ -318,8 +1470,10 @@ def print_data():
         i += 1
 
 
+@instrumented
+@cached_read
 def get_counts():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute(
         """
@@ -333,11 +1487,11 @@ def get_counts():
         """
     )
     available_images = c.fetchone()[0]
-    conn.close()
     return {"all": all_images, "available": available_images}
 
+@instrumented
 def get_filepaths():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute(
         """
@@ -345,12 +1499,12 @@ def get_filepaths():
         """
     )
     data = c.fetchall()
-    conn.close()
     return data
 
 
+@instrumented
 def check_if_exists(filename):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute(
         """
@@ -359,7 +1513,6 @@ def check_if_exists(filename):
         (filename,),
     )
     data = c.fetchall()
-    conn.close()
     if len(data) > 0:
         print(data[0][0])
         return True, data[0][0]
@@ -367,21 +1520,10 @@ def check_if_exists(filename):
         return False, None
 
 
-def get_metadata_from_filename(filename):
-    if "/" in filename:
-        filename = filename.split("/")[-1]
-    node_id = filename.split("_")[0]
-    date = filename.split("_")[1]
-    date = date.split(".")[0]
-    # parse date from this format: 2021-06-26T11-04-04Z
-    dt = datetime.datetime.strptime(date, "%Y-%m-%dT%H-%M-%SZ")
-    return node_id, dt
-
-
-
-
+@instrumented
+@writes
 def set_all_not_available():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute(
         """
@@ -389,24 +1531,104 @@ def set_all_not_available():
         """
     )
     conn.commit()
-    conn.close()
 
+@instrumented
+@cached_read
 def get_node_ids(include_unavailable=False):
+    query = Query("node_stats", "node_id")
+    if include_unavailable:
+        query.where("count_images > 0")
+    else:
+        query.where("count_available > 0")
+    return query.execute().fetchall()
 
-    query = "SELECT DISTINCT node_id FROM images"
-    if not include_unavailable:
-        query += " WHERE available = true"
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute(
-        query
-    )
-    data = c.fetchall()
-    conn.close()
-    return data
 
+class Query:
+    # builds bound-parameter SQL whose text only depends on which filters are
+    # used, so sqlite's statement cache can reuse the prepared statement
+    def __init__(self, table, columns="*"):
+        self.table = table
+        self.columns = columns
+        self.conditions = []
+        self.params = []
+        self.order = None
+        self.limit_params = None
+
+    def where(self, clause, *params):
+        self.conditions.append(clause)
+        self.params.extend(params)
+        return self
+
+    def order_by(self, order):
+        self.order = order
+        return self
+
+    def limit(self, limit, offset=0):
+        self.limit_params = [limit, offset]
+        return self
+
+    def sql(self):
+        sql = "SELECT {} FROM {}".format(self.columns, self.table)
+        if len(self.conditions) > 0:
+            sql += " WHERE " + " AND ".join(self.conditions)
+        if self.order is not None:
+            sql += " ORDER BY " + self.order
+        if self.limit_params is not None:
+            sql += " LIMIT ? OFFSET ?"
+        return sql
+
+    def all_params(self):
+        if self.limit_params is None:
+            return self.params
+        return self.params + self.limit_params
+
+    def execute(self):
+        return get_read_connection().execute(self.sql(), self.all_params())
+
+    def explain(self):
+        # EXPLAIN QUERY PLAN output, one string per plan step
+        rows = get_read_connection().execute(
+            "EXPLAIN QUERY PLAN " + self.sql(), self.all_params()
+        )
+        return [row[3] for row in rows]
+
+
+SELECTION_CONDITIONS = {
+    2: "flower IS NULL",
+    3: "flower IS NOT NULL",
+    4: "flower = 0",
+    5: "favorite = 1",
+}
 
+
+def selection_query(
+    node_id=None,
+    starttime_h=None,
+    endtime_h=None,
+    startdate=None,
+    enddate=None,
+    seen_unseen_not_sure=1,
+    columns="path",
+    table="images",
+):
+    query = Query(table, columns)
+    if node_id is not None:
+        query.where("node_id = ?", node_id)
+    if starttime_h is not None:
+        query.where("minute_of_day >= ?", int(starttime_h) * 60)
+    if endtime_h is not None:
+        query.where("minute_of_day <= ?", int(endtime_h) * 60)
+    if startdate is not None:
+        query.where("epoch >= ?", _to_epoch(startdate))
+    if enddate is not None:
+        query.where("epoch <= ?", _to_epoch(enddate, True))
+    if seen_unseen_not_sure in SELECTION_CONDITIONS:
+        query.where(SELECTION_CONDITIONS[seen_unseen_not_sure])
+    query.where("available = true")
+    return query.order_by("node_id, date asc")
+
+
+@instrumented
 def get_filelist_by_selection(
     node_id=None,
     starttime_h=None,
@@ -415,75 +1637,57 @@ def get_filelist_by_selection(
     enddate=None,
     seen_unseen_not_sure=1,
 ):
+    query = selection_query(
+        node_id, starttime_h, endtime_h, startdate, enddate, seen_unseen_not_sure
+    )
+    return query.execute().fetchall()
 
-    condition_string = ""
-    if node_id is not None:
-        if condition_string == "":
 
-            condition_string += "WHERE node_id = '{}'".format(node_id)
-        else:
-            condition_string += " AND node_id = '{}'".format(node_id)
-    if starttime_h is not None:
-        starttime_h_str = str(starttime_h)+":00"
-        if starttime_h<10:
-            starttime_h_str = "0"+starttime_h_str
+@instrumented
+def get_selection_count(**filters):
+    query = selection_query(columns="count(*)", **filters).order_by(None)
+    return query.execute().fetchone()[0]
 
-        if condition_string == "":
-            condition_string += "WHERE strftime('%H:%M', date) >= '{}'".format(starttime_h_str)
-        else:
-            condition_string += " AND strftime('%H:%M', date) >= '{}'".format(starttime_h_str)
-    if endtime_h is not None:
-        endtime_h_str = str(endtime_h)+":00"
-        if endtime_h<10:
-            endtime_h_str = "0"+endtime_h_str
-        if condition_string == "":
-            condition_string += "WHERE strftime('%H:%M', date) <= '{}'".format(endtime_h_str)
-        else:
-            condition_string += " AND strftime('%H:%M', date) <= '{}'".format(endtime_h_str)
 
-    if seen_unseen_not_sure == 2:
-        if condition_string == "":
-            condition_string += "WHERE flower IS NULL"
-        else:
-            condition_string += " AND flower IS NULL"
-    if seen_unseen_not_sure == 3:
-        if condition_string == "":
-            condition_string += "WHERE flower IS NOT NULL"
-        else:
-            condition_string += " AND flower IS NOT NULL"
-    if seen_unseen_not_sure == 4:
-        if condition_string == "":
-            condition_string += "WHERE flower = 0"
-        else:
-            condition_string += " AND flower = 0"
-    if seen_unseen_not_sure == 5:
-        if condition_string == "":
-            condition_string += "WHERE favorite = 1"
-        else:
-            condition_string += " AND favorite = 1"
-    
-    if condition_string == "":
-        condition_string = "WHERE available = true"
+@instrumented
+def get_selection_window(filters, limit, offset=0, after=None, before=None):
+    # keyset paging over a selection in (node_id, date, rowid) order, which is
+    # the order of idx_images_available_node_date, so windows are read straight
+    # off the index. rows are (node_id, date, rowid, path); after/before are
+    # such a row. with before, rows are returned in descending order
+    query = selection_query(
+        columns="node_id, date, rowid, path",
+        table="images INDEXED BY idx_images_available_node_date",
+        **filters
+    )
+    if filters.get("node_id") is not None:
+        # node_id is fixed, leaving it in the key makes sqlite sort
+        key = "(date, rowid) {} (?, ?)"
+        key_columns = slice(1, 3)
+        ascending, descending = "date, rowid", "date DESC, rowid DESC"
+    else:
+        key = "(node_id, date, rowid) {} (?, ?, ?)"
+        key_columns = slice(0, 3)
+        ascending = "node_id, date, rowid"
+        descending = "node_id DESC, date DESC, rowid DESC"
+    if after is not None:
+        query.where(key.format(">"), *after[key_columns]).order_by(ascending)
+    elif before is not None:
+        query.where(key.format("<"), *before[key_columns]).order_by(descending)
     else:
-        condition_string += " AND available = true"
+        query.order_by(ascending)
+    return query.limit(limit, offset).execute().fetchall()
 
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    print(condition_string)
 
-    c.execute(
-        """
-            SELECT path FROM images {} ORDER BY node_id, date asc
-            """.format(
-            condition_string
-        )
-    )
-    data = c.fetchall()
-    conn.close()
-    return data
+def explain_selection(**kwargs):
+    # query plan of get_filelist_by_selection for the given filters
+    return selection_query(**kwargs).explain()
 
+
+@instrumented
+@writes
 def set_favorite(filename, favorite):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute(
         """
@@ -492,10 +1696,11 @@ def set_favorite(filename, favorite):
         (favorite, filename),
     )
     conn.commit()
-    conn.close()
 
+@instrumented
+@writes
 def set_flower(filename, flower):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute(
         """
@@ -504,99 +1709,105 @@ def set_flower(filename, flower):
         (flower, filename),
     )
     conn.commit()
-    conn.close()
 
 
+@instrumented
+@writes
+def set_labels(flowers, favorites):
+    # flowers / favorites: {filename: value}, written in one transaction
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            """
+            UPDATE images SET flower = ? WHERE filename = ?
+            """,
+            ((flower, filename) for filename, flower in flowers.items()),
+        )
+        conn.executemany(
+            """
+            UPDATE images SET favorite = ? WHERE filename = ?
+            """,
+            ((favorite, filename) for filename, favorite in favorites.items()),
+        )
+
+
+@instrumented
+@cached_read
 def get_counts_by_node_as_df():
-    conn = sqlite3.connect(DB_PATH)
+    # node_stats is maintained by triggers on images, see MIGRATIONS
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute("""
     select node_id,
-        count(*) ,
-        count(flower),
-        count(case flower when 1 then 1 else null end),
-        count(case flower when 0 then 1 else null end),
-        count(case flower when -1 then 1 else null end) 
-        
-        FROM images GROUP BY node_id
+        count_images,
+        count_classified,
+        count_flower,
+        count_not_sure,
+        count_no_flower
+        FROM node_stats WHERE count_images > 0 ORDER BY node_id
     """
     )
     data = c.fetchall()
-    conn.close()
     df = pd.DataFrame(data, columns=["node_id", "count_images", "count_classified", "count_flower", "count_not_sure","count_no_flower"])
     return df
 
-def get_image_dates_by_node_as_df(node_id):
-    conn = sqlite3.connect(DB_PATH)
+@instrumented
+@cached_read
+def get_image_dates_by_node_as_df(node_id, include_archive=False):
+    if ANALYTICS_BACKEND == "duckdb" and not include_archive:
+        import analytics
+
+        return analytics.get_image_dates_by_node_as_df(node_id)
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute("""
-    select distinct(strftime('%Y-%m-%d', date)) from images where node_id = ? order by date asc
-    """,
+    select distinct(strftime('%Y-%m-%d', date)) from {} where node_id = ? order by date asc
+    """.format(_images_table(include_archive)),
     (node_id,)
     )
     data = c.fetchall()
-    conn.close()
     df = pd.DataFrame(data, columns=["date"])
     return df
 
-def get_data_by_node_as_df(node_id, excludeNaN=False):
-    query = "SELECT * FROM images WHERE node_id = ?"
+@instrumented
+@cached_read
+def get_data_by_node_as_df(node_id, excludeNaN=False, include_archive=False):
+    query = Query(
+        _images_table(include_archive),
+        "filename, path, node_id, date, flower, pollinator, capture_type, favorite, available",
+    ).where("node_id = ?", node_id)
     if excludeNaN:
-        query+=" AND flower IS NOT NULL"
-    query+=" order by date asc"
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-       query,
-        (node_id,),
-    )
-    data = c.fetchall()
-    conn.close()
-    df = pd.DataFrame(
-        data,
-        columns=[
-            "filename",
-            "path",
-            "node_id",
-            "date",
-            "flower",
-            "pollinator",
-            "capture_type",
-            "favorite",
-            "available"
-        ],
-    )
-
-    return df
+        query.where("flower IS NOT NULL")
+    return _load_df(query.order_by("date asc").execute(), IMAGE_DTYPES)
 
+@instrumented
 def check_if_file_available(filename):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute(
         """
-        SELECT available FROM images WHERE filename = ?
+        SELECT available FROM all_images WHERE filename = ?
         """,
         (filename,),
     )
     data = c.fetchall()
-    conn.close()
     if len(data) == 0:
         return False
     else:
         return data[0][0]
 
+@instrumented
 def get_path_from_filename(filename):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_read_connection()
     c = conn.cursor()
     c.execute(
         """
-        SELECT path FROM images WHERE filename = ?
+        SELECT path FROM all_images WHERE filename = ?
         """,
         (filename,),
     )
     data = c.fetchall()
-    conn.close()
     if len(data) == 0:
         return None
     else:
-        return data[0][0]
\ No newline at end of file
+        return data[0][0]
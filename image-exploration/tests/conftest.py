@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# the modules of image-exploration import each other by plain name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import configuration
+
+# sqlitehelper creates its database on import, keep it out of the cwd
+_import_dir = tempfile.mkdtemp(prefix="image_exploration_tests_")
+configuration.DB_PATH = os.path.join(_import_dir, "flower_image_db.db")
+configuration.ARCHIVE_DIR = os.path.join(_import_dir, "archive")
+configuration.SLOW_QUERY_LOG_PATH = None
+
+import sqlitehelper
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # a fresh, migrated database in tmp_path
+    sqlitehelper.close_connection()
+    monkeypatch.setattr(sqlitehelper, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(sqlitehelper, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    sqlitehelper.migrate()
+    sqlitehelper._bump_generation()
+    yield str(tmp_path / "test.db")
+    sqlitehelper.close_connection()
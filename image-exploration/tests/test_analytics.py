@@ -0,0 +1,92 @@
+import inspect
+
+import pandas as pd
+import pytest
+
+import sqlitehelper
+
+duckdb = pytest.importorskip("duckdb")
+import analytics
+
+# sqlitehelper functions that are answered by analytics with
+# ANALYTICS_BACKEND = "duckdb", with their arguments and a column that
+# orders the rows the same way on both backends
+ROUTED = [
+    ("get_all_data_as_df", (), "filename"),
+    ("get_categorized_as_df", (), "filename"),
+    ("get_image_dates_by_node_as_df", ("a",), "date"),
+    ("get_image_dates_by_node_as_df", ("b",), "date"),
+    ("get_image_dates_by_node_as_df", ("missing",), "date"),
+]
+
+
+def _use_duckdb(monkeypatch, mode):
+    monkeypatch.setattr(analytics, "ANALYTICS_MODE", mode)
+    monkeypatch.setattr(analytics, "DB_PATH", sqlitehelper.DB_PATH)
+    monkeypatch.setattr(analytics, "_duck", None)
+    monkeypatch.setattr(analytics, "_refreshed_at", None)
+    monkeypatch.setattr(analytics, "_refreshed_generation", None)
+    monkeypatch.setattr(sqlitehelper, "ANALYTICS_BACKEND", "duckdb")
+    try:
+        analytics.get_duckdb()
+    except duckdb.Error as e:
+        # attach needs the sqlite extension, which may have to be downloaded
+        pytest.skip("duckdb cannot read the database in {} mode: {}".format(mode, e))
+
+
+@pytest.fixture
+def labelled(db):
+    sqlitehelper.bulk_ingest(
+        [
+            "a/2021-06-26/a_2021-06-26T11-04-04Z.jpg",
+            "a/2021-06-26/a_2021-06-26T11-04-04Z_1.jpg",
+            "a/2021-06-27/a_2021-06-27T08-00-00Z.jpg",
+            "b/2021-07-01/b_2021-07-01T23-59-59Z.jpg",
+            "b/2021-07-02/b_2021-07-02T00-00-00Z.jpg",
+        ]
+    )
+    sqlitehelper.set_labels(
+        {"a_2021-06-26T11-04-04Z.jpg": 1, "b_2021-07-01T23-59-59Z.jpg": -1},
+        {"a_2021-06-26T11-04-04Z.jpg": 1},
+    )
+    sqlitehelper.set_unavailable_from_list(["b_2021-07-02T00-00-00Z.jpg"])
+
+
+def test_every_routed_function_is_checked():
+    routed = {
+        name
+        for name, function in inspect.getmembers(sqlitehelper, inspect.isfunction)
+        if 'ANALYTICS_BACKEND == "duckdb"' in inspect.getsource(function)
+    }
+    assert routed == {name for name, args, key in ROUTED}
+
+
+@pytest.mark.parametrize("mode", ["copy", "attach"])
+@pytest.mark.parametrize("name, args, key", ROUTED)
+def test_parity(labelled, monkeypatch, mode, name, args, key):
+    function = getattr(sqlitehelper, name).uncached
+    monkeypatch.setattr(sqlitehelper, "ANALYTICS_BACKEND", "sqlite")
+    expected = function(*args)
+    _use_duckdb(monkeypatch, mode)
+    got = function(*args)
+    if expected is None or got is None:
+        assert expected is None and got is None
+        return
+    pd.testing.assert_frame_equal(
+        got.sort_values(key).reset_index(drop=True),
+        expected.sort_values(key).reset_index(drop=True),
+    )
+
+
+def test_stale_copy_is_not_cached(db, monkeypatch):
+    monkeypatch.setattr(analytics, "ANALYTICS_REFRESH_INTERVAL", 3600)
+    _use_duckdb(monkeypatch, "copy")
+    sqlitehelper.bulk_ingest(["n/2021-06-26/n_2021-06-26T11-04-04Z.jpg"])
+    monkeypatch.setattr(analytics, "_refreshed_at", None)
+    assert len(sqlitehelper.get_categorized_as_df()) == 0
+
+    sqlitehelper.set_flower("n_2021-06-26T11-04-04Z.jpg", 1)
+    # served from the copy until it is reloaded
+    assert len(sqlitehelper.get_categorized_as_df()) == 0
+    monkeypatch.setattr(analytics, "ANALYTICS_REFRESH_INTERVAL", 0)
+    assert len(sqlitehelper.get_categorized_as_df()) == 1
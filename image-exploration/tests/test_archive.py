@@ -0,0 +1,41 @@
+import pytest
+
+import sqlitehelper
+
+
+def ingest(*stamps):
+    sqlitehelper.bulk_ingest(
+        ["n/{0}/n_{0}T11-04-04Z.jpg".format(stamp) for stamp in stamps], full_sync=False
+    )
+
+
+def test_archived_images_stay_available(db):
+    ingest("2021-06-26", "2022-06-26")
+    assert sqlitehelper.archive_season(2021) == 1
+    assert sqlitehelper.check_if_file_available("n_2021-06-26T11-04-04Z.jpg") == 1
+    assert (
+        sqlitehelper.get_path_from_filename("n_2021-06-26T11-04-04Z.jpg")
+        == "n/2021-06-26/n_2021-06-26T11-04-04Z.jpg"
+    )
+
+
+def test_archive_season_again(db):
+    ingest("2021-06-26", "2022-06-26")
+    assert sqlitehelper.archive_season(2021) == 1
+    # e.g. images of the season that were inserted afterwards
+    sqlitehelper.insert_from_list(["n/2021-07-01/n_2021-07-01T11-04-04Z.jpg"])
+    assert sqlitehelper.archive_season(2021) == 1
+    conn = sqlitehelper.get_connection()
+    assert conn.execute("SELECT count(*) FROM season_2021.images").fetchone()[0] == 2
+    assert conn.execute("SELECT count(*) FROM main.images").fetchone()[0] == 1
+
+
+def test_archive_season_attach_limit(db, monkeypatch):
+    monkeypatch.setattr(sqlitehelper, "_max_attached", lambda conn: 2)
+    ingest("2019-06-26", "2020-06-26", "2021-06-26")
+    sqlitehelper.archive_season(2019)
+    sqlitehelper.archive_season(2020)
+    with pytest.raises(RuntimeError, match="at most 2"):
+        sqlitehelper.archive_season(2021)
+    # the archived seasons can be archived again
+    assert sqlitehelper.archive_season(2020) == 0
@@ -0,0 +1,38 @@
+import threading
+
+import sqlitehelper
+
+
+def connection_of_new_thread():
+    # like flask's threaded server, a new thread per request
+    used = []
+
+    def request():
+        conn = sqlitehelper.get_connection()
+        # given back when the outermost helper call returns
+        sqlitehelper.get_path_from_filename("x.jpg")
+        used.append(conn)
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    thread.join()
+    return used[0]
+
+
+def test_connections_are_reused_across_threads(db):
+    sqlitehelper.close_connection()
+    first = connection_of_new_thread()
+    assert connection_of_new_thread() is first
+    # the connection is set up once, e.g. with its temp views
+    assert first.execute("SELECT count(*) FROM all_images").fetchone() == (0,)
+
+
+def test_connection_in_transaction_stays_with_its_thread(db):
+    sqlitehelper.close_connection()
+    conn = sqlitehelper.get_connection()
+    conn.execute("BEGIN")
+    sqlitehelper.get_path_from_filename("x.jpg")
+    assert sqlitehelper.get_connection() is conn
+    conn.rollback()
+    sqlitehelper.get_path_from_filename("x.jpg")
+    assert connection_of_new_thread() is conn
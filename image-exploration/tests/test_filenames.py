@@ -0,0 +1,53 @@
+import datetime
+
+import pytest
+
+import sqlitehelper
+from filenames import get_metadata_from_filename, get_time_columns, parse_filenames
+
+
+def test_parse_filenames_matches_scalar_parser():
+    paths = [
+        "abc/2021-06-26/abc_2021-06-26T11-04-04Z.jpg",
+        "abc/2021-06-26/abc_2021-6-26T11-04-04Z.jpg",
+        "def/2021-07-01/def_2021-07-01T09-30-00Z_1.jpg",
+    ]
+    df = parse_filenames(paths)
+    for row, path in zip(df.itertuples(), paths):
+        node_id, dt = get_metadata_from_filename(path)
+        minute_of_day, epoch = get_time_columns(dt)
+        assert row.node_id == node_id
+        assert row.date == str(dt)
+        assert row.minute_of_day == minute_of_day
+        assert row.epoch == epoch
+
+
+def test_parse_filenames_rejects_bad_names():
+    with pytest.raises(ValueError):
+        parse_filenames(["abc/abc_2021-06-26T11-04-04Z.jpg", "abc/abc_notadate.jpg"])
+
+
+def test_bulk_ingest_non_padded_name(db):
+    path = "NODE/2021-06-26/NODE_2021-6-26T11-04-04Z.jpg"
+    sqlitehelper.bulk_ingest([path])
+    row = sqlitehelper.get_connection().execute(
+        "SELECT date, minute_of_day, epoch FROM images WHERE path = ?", (path,)
+    ).fetchone()
+    dt = datetime.datetime(2021, 6, 26, 11, 4, 4)
+    assert row == (str(dt), 11 * 60 + 4, get_time_columns(dt)[1])
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "n_2021-06-26T25-61-04Z.jpg",
+        "n_2021-13-26T11-04-04Z.jpg",
+        "n_2021-02-30T11-04-04Z.jpg",
+        "n_2021-06-26T11-04-60Z.jpg",
+    ],
+)
+def test_parse_filenames_rejects_out_of_range_fields(name):
+    with pytest.raises(ValueError):
+        get_metadata_from_filename(name)
+    with pytest.raises(ValueError):
+        parse_filenames(["n/2021-06-26/n_2021-06-26T11-04-04Z.jpg", "n/x/" + name])
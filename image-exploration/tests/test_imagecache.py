@@ -0,0 +1,15 @@
+import pytest
+
+flask = pytest.importorskip("flask")
+pytest.importorskip("skimage")
+import imagecache
+
+
+def test_local_path_only_maps_own_image_routes(monkeypatch):
+    monkeypatch.setattr(imagecache, "IMAGE_SERVER_URL", "http://images:8051")
+    monkeypatch.setattr(imagecache, "BASE_PATH", "/originals/")
+    with flask.Flask(__name__).test_request_context(base_url="http://localhost:8050"):
+        assert imagecache.local_path("http://localhost:8050/image/n/a%20b.jpg") == "/originals/n/a b.jpg"
+        assert imagecache.local_path("http://images:8051/image/n/a.jpg?w=300") == "/originals/n/a.jpg"
+        assert imagecache.local_path("http://example.com/image/n/a.jpg") is None
+        assert imagecache.local_path("http://localhost:8050/other/image/n/a.jpg") is None
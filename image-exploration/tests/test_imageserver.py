@@ -0,0 +1,73 @@
+import asyncio
+import os
+
+import imageserver
+
+
+def request(tmp_path, monkeypatch, raw, variant=None):
+    # sends raw to an ImageServer on tmp_path and returns all it answers
+    # until the connection closes
+    if variant is not None:
+        monkeypatch.setattr(imageserver, "get_variant", variant)
+
+    async def run():
+        server = imageserver.ImageServer(str(tmp_path) + "/", 4, 2)
+        listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(raw)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return response
+
+    return asyncio.run(run())
+
+
+def etag_of(response):
+    for line in response.split(b"\r\n"):
+        if line.lower().startswith(b"etag:"):
+            return line.split(b":", 1)[1].strip()
+
+
+def test_variant_etag_survives_cache_hits(tmp_path, monkeypatch):
+    (tmp_path / "a.jpg").write_bytes(b"original")
+    variant_path = tmp_path / "variant.jpg"
+    variant_path.write_bytes(b"small")
+    hits = []
+
+    def touching_variant(src_path, width, quality):
+        # like ThumbnailCache.get, which touches the variant on every hit
+        hits.append(src_path)
+        os.utime(variant_path, ns=(len(hits) * 10**9, len(hits) * 10**9))
+        return str(variant_path)
+
+    get = b"GET /image/a.jpg?w=1920 HTTP/1.1\r\nConnection: close\r\n\r\n"
+    first = request(tmp_path, monkeypatch, get, touching_variant)
+    assert first.startswith(b"HTTP/1.1 200") and first.endswith(b"small")
+    etag = etag_of(first)
+    revalidate = (
+        b"GET /image/a.jpg?w=1920 HTTP/1.1\r\nIf-None-Match: " + etag
+        + b"\r\nConnection: close\r\n\r\n"
+    )
+    assert request(tmp_path, monkeypatch, revalidate, touching_variant).startswith(
+        b"HTTP/1.1 304"
+    )
+    original = request(tmp_path, monkeypatch, b"GET /image/a.jpg HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert etag_of(original) != etag
+
+
+def test_request_body_is_not_parsed_as_next_request(tmp_path, monkeypatch):
+    (tmp_path / "a.jpg").write_bytes(b"original")
+    body = b"GET /image/nothing HTTP/1.1\r\n\r\n"
+    raw = (
+        b"POST /image/a.jpg HTTP/1.1\r\nContent-Length: "
+        + str(len(body)).encode() + b"\r\n\r\n" + body
+        + b"GET /image/a.jpg HTTP/1.1\r\nConnection: close\r\n\r\n"
+    )
+    response = request(tmp_path, monkeypatch, raw)
+    assert response.startswith(b"HTTP/1.1 405")
+    assert response.count(b"HTTP/1.1 ") == 2
+    assert b"HTTP/1.1 200 OK" in response and response.endswith(b"original")
@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import sqlitehelper
+
+IMPORT_SQLITEHELPER = """
+import sys
+sys.path.insert(0, {src!r})
+import configuration
+configuration.DB_PATH = {db!r}
+configuration.ARCHIVE_DIR = {archive!r}
+configuration.SLOW_QUERY_LOG_PATH = None
+import sqlitehelper
+"""
+
+
+def test_concurrent_migrations(tmp_path):
+    # e.g. the dash app and update_db.py --watch starting together
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = IMPORT_SQLITEHELPER.format(
+        src=src, db=str(tmp_path / "test.db"), archive=str(tmp_path / "archive")
+    )
+    processes = [
+        subprocess.Popen([sys.executable, "-c", script], stderr=subprocess.PIPE)
+        for _ in range(4)
+    ]
+    for process in processes:
+        _, stderr = process.communicate(timeout=60)
+        assert process.returncode == 0, stderr.decode()
+    conn = sqlite3.connect(tmp_path / "test.db")
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(sqlitehelper.MIGRATIONS)
+
+
+def test_split_statements_keeps_triggers():
+    statements = sqlitehelper._split_statements(sqlitehelper.MIGRATIONS[4])
+    assert len(statements) == 5
+    assert statements[2].startswith("CREATE TRIGGER") and statements[2].endswith("END;")
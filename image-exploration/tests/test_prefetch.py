@@ -0,0 +1,42 @@
+import threading
+
+import annot
+import sqlitehelper
+import thumbnails
+
+
+def test_neighbours_do_not_move_the_window(db, monkeypatch):
+    monkeypatch.setattr(annot, "IMAGE_LIST_WINDOW", 5)
+    paths = ["n/2021-06-26/n_2021-06-26T11-04-{:02d}Z.jpg".format(i) for i in range(20)]
+    sqlitehelper.bulk_ingest(paths)
+    image_list = annot.ImageList("")
+    calls = []
+    get_selection_window = annot.get_selection_window
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return get_selection_window(*args, **kwargs)
+
+    monkeypatch.setattr(annot, "get_selection_window", counted)
+    assert image_list.get_first_file() == paths[0]
+    for index in range(1, 20):
+        assert image_list.get_next_file() == paths[index]
+        window = (image_list.window_start, list(image_list.window))
+        neighbours = image_list.get_neighbours(3)
+        assert (image_list.window_start, image_list.window) == window
+        assert neighbours == paths[index + 1 : index + 4] + paths[max(index - 3, 0) : index][::-1]
+    # the windows plus a small query where the neighbours cross their edge
+    assert len(calls) < 2 * 19
+
+
+def test_warm_queue_is_bounded(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(thumbnails, "Image", object())
+    monkeypatch.setattr(thumbnails, "_warm", lambda *job: release.wait())
+    try:
+        for i in range(100):
+            thumbnails.warm_variants(["{}.jpg".format(i)], 1920)
+        assert len(thumbnails._warm_queue) <= thumbnails.WARM_QUEUE_SIZE
+        assert thumbnails._warm_queue[-1][0].endswith("99.jpg")
+    finally:
+        release.set()
@@ -0,0 +1,33 @@
+import sqlite3
+import threading
+
+import sqlitehelper
+
+
+def in_new_thread(func):
+    # like flask's threaded server, which handles each request on a new thread
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_external_write_invalidates_cache_on_new_threads(db):
+    sqlitehelper.bulk_ingest(
+        ["n/2021-06-26/n_2021-06-26T11-04-0{}Z.jpg".format(i) for i in range(3)]
+    )
+    assert in_new_thread(sqlitehelper.get_counts)["all"] == 3
+    assert in_new_thread(sqlitehelper.get_counts)["all"] == 3
+
+    # another process, e.g. update_db --watch
+    external = sqlite3.connect(db)
+    external.execute(
+        "INSERT INTO images (filename, path, node_id, date, available)"
+        " VALUES ('n_x.jpg', 'n/x/n_x.jpg', 'n', '2021-06-26 12:00:00', 1)"
+    )
+    external.commit()
+    external.close()
+
+    assert in_new_thread(sqlitehelper.get_counts)["all"] == 4
+    assert sqlitehelper.get_counts()["all"] == 4
@@ -0,0 +1,32 @@
+import sqlite3
+
+import sqlitehelper
+
+
+def test_own_writes_do_not_trigger_a_reload(db, monkeypatch):
+    sqlitehelper.bulk_ingest(["n/2021-06-26/n_2021-06-26T11-04-04Z.jpg"])
+    snapshot = sqlitehelper.ReadSnapshot(3600)
+    monkeypatch.setattr(sqlitehelper, "_snapshot", snapshot)
+    sqlitehelper.close_connection()
+
+    def changed_elsewhere():
+        version = snapshot.disk.execute("PRAGMA data_version").fetchone()[0]
+        return version != snapshot.data_version
+
+    sqlitehelper.set_flower("n_2021-06-26T11-04-04Z.jpg", 1)
+    assert sqlitehelper.get_read_connection().execute(
+        "SELECT flower FROM images"
+    ).fetchone() == (1,)
+    assert not changed_elsewhere()
+
+    external = sqlite3.connect(db)
+    external.execute("UPDATE images SET flower = 0")
+    external.commit()
+    external.close()
+    assert changed_elsewhere()
+    snapshot.refresh()
+    assert not changed_elsewhere()
+    assert sqlitehelper.get_read_connection().execute(
+        "SELECT flower FROM images"
+    ).fetchone() == (0,)
+    sqlitehelper.close_connection()
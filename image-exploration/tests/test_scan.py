@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import annot
+
+
+def make_tree(root):
+    for day in ["2021-06-26", "2021-06-27"]:
+        (root / "n" / day).mkdir(parents=True)
+        (root / "n" / day / "n_{}T11-04-04Z.jpg".format(day)).write_bytes(b"")
+    return sorted(
+        ["n/2021-06-26/n_2021-06-26T11-04-04Z.jpg", "n/2021-06-27/n_2021-06-27T11-04-04Z.jpg"]
+    )
+
+
+def test_scan_does_not_follow_directory_symlinks(tmp_path):
+    expected = make_tree(tmp_path)
+    os.symlink("..", tmp_path / "n" / "2021-06-26" / "up")
+    assert sorted(annot.iter_file_list(str(tmp_path))) == expected
+
+
+@pytest.mark.parametrize("error", [FileNotFoundError, PermissionError])
+def test_scan_skips_directories_it_cannot_list(tmp_path, monkeypatch, error):
+    # e.g. a directory deleted while the scan runs, or one without access
+    expected = make_tree(tmp_path)
+    scandir = os.scandir
+    broken = os.path.join(str(tmp_path), "n/2021-06-27")
+
+    def failing_scandir(path):
+        if path == broken:
+            raise error(path)
+        return scandir(path)
+
+    monkeypatch.setattr(annot.os, "scandir", failing_scandir)
+    assert sorted(annot.iter_file_list(str(tmp_path))) == expected[:1]
+    scan = {}
+    assert sorted(annot.scan_changed_dirs(str(tmp_path), {}, scan)) == expected[:1]
+    assert "n/2021-06-27" not in scan["changed"]
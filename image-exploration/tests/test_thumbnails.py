@@ -0,0 +1,82 @@
+import os
+import time
+
+import thumbnails
+
+
+def test_load_keeps_recent_temporary_files(tmp_path):
+    (tmp_path / "ab").mkdir()
+    variant = tmp_path / "ab" / "ab12.jpg"
+    variant.write_bytes(b"variant")
+    # another process writing a variant, and a leftover of a crash
+    in_flight = tmp_path / "ab" / "ab34.jpg.123-456.tmp"
+    in_flight.write_bytes(b"partial")
+    stale = tmp_path / "ab" / "ab56.jpg.789-456.tmp"
+    stale.write_bytes(b"partial")
+    old = time.time() - thumbnails.STALE_TMP_SECONDS - 60
+    os.utime(stale, (old, old))
+
+    cache = thumbnails.ThumbnailCache(str(tmp_path), 1024)
+    assert in_flight.exists()
+    assert not stale.exists()
+    assert list(cache.entries) == [str(variant)]
+    assert cache.total_bytes == len(b"variant")
+
+
+def _fake_resize(calls):
+    def resize(self, src_path, cache_path, width, quality):
+        calls.append(cache_path)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "wb") as f:
+            f.write(b"x" * 40)
+        return True
+
+    return resize
+
+
+def test_variants_of_other_processes_are_reused(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(thumbnails.ThumbnailCache, "_resize", _fake_resize(calls))
+    src = tmp_path / "a.jpg"
+    src.write_bytes(b"original")
+    # e.g. the dash app and imageserver.py
+    first = thumbnails.ThumbnailCache(str(tmp_path / "cache"), 1024)
+    second = thumbnails.ThumbnailCache(str(tmp_path / "cache"), 1024)
+
+    variant = first.get(str(src), 300, 80)
+    assert second.get(str(src), 300, 80) == variant
+    assert calls == [variant]
+    assert second.total_bytes == 40
+
+
+def test_budget_covers_the_variants_of_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails.ThumbnailCache, "_resize", _fake_resize([]))
+    monkeypatch.setattr(thumbnails, "CACHE_RESCAN_SECONDS", 0)
+    caches = [thumbnails.ThumbnailCache(str(tmp_path / "cache"), 100) for _ in range(2)]
+    for i in range(6):
+        src = tmp_path / "{}.jpg".format(i)
+        src.write_bytes(b"original")
+        caches[i % 2].get(str(src), 300, 80)
+    on_disk = [f for f in (tmp_path / "cache").rglob("*.jpg")]
+    assert sum(f.stat().st_size for f in on_disk) <= 100
+
+
+def test_warm_asks_the_image_server(monkeypatch):
+    requests = []
+
+    class Response:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    def urlopen(request, timeout):
+        requests.append((request.get_method(), request.full_url))
+        return Response()
+
+    monkeypatch.setattr(thumbnails, "IMAGE_SERVER_URL", "http://images:8051")
+    monkeypatch.setattr(thumbnails.urllib.request, "urlopen", urlopen)
+    monkeypatch.setattr(thumbnails, "get_variant", None)
+    thumbnails._warm("n/2021-06-26/n 1.jpg", 600, 80)
+    assert requests == [("HEAD", "http://images:8051/image/n/2021-06-26/n%201.jpg?w=600&q=80")]
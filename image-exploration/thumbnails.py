@@ -0,0 +1,289 @@
+import argparse
+import hashlib
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from configuration import (
+    BASE_PATH,
+    THUMBNAIL_CACHE_DIR,
+    THUMBNAIL_CACHE_BYTES,
+    THUMBNAIL_WIDTHS,
+    THUMBNAIL_QUALITY,
+    THUMBNAIL_WARM_WORKERS,
+    IMAGE_SERVER_URL,
+    SCAN_WORKERS,
+)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# resized jpeg variants of the originals below BASE_PATH, served by /image
+# with ?w=<width>&q=<quality>. widths are rounded up to THUMBNAIL_WIDTHS so
+# only a few variants exist per image
+
+# temporary files older than this are leftovers of interrupted writes,
+# younger ones may be written by another process using the same cache dir
+# (e.g. imageserver.py next to the dash app)
+STALE_TMP_SECONDS = 3600
+
+# the files in the cache dir are rescanned at most this often, so the
+# variants other processes added count against max_bytes as well
+CACHE_RESCAN_SECONDS = 60
+
+# seconds a warm request to the image server may take
+WARM_TIMEOUT = 30
+
+
+class ThumbnailCache:
+    # variants on disk, keyed by source path, mtime and size plus width and
+    # quality, so a replaced original gets new variants. the cache is bounded
+    # to max_bytes, the least recently served variants are removed first.
+    # the cache dir can be shared by several processes: variants are looked
+    # up on disk before they are created, and recency and size are taken
+    # from the files, which every hit touches
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # cache path -> size, oldest first
+        self.pending = {}  # cache path -> Event, variants being created
+        self.total_bytes = 0
+        self.scanned_at = time.time()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        # rebuilds the entries from the files in cache_dir, in mtime order,
+        # and evicts down to max_bytes. recency survives restarts this way
+        files = []
+        for root, dirs, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                    if name.endswith(".tmp"):
+                        if time.time() - st.st_mtime > STALE_TMP_SECONDS:
+                            os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    # renamed or removed by another process meanwhile
+                    continue
+                if name.endswith(".jpg"):
+                    files.append((st.st_mtime, path, st.st_size))
+        entries = OrderedDict((path, size) for mtime, path, size in sorted(files))
+        with self.lock:
+            self.entries = entries
+            self.total_bytes = sum(entries.values())
+            self._evict()
+
+    def _cache_path(self, src_path, st, width, quality):
+        key = "{}|{}|{}|{}|{}".format(src_path, st.st_mtime_ns, st.st_size, width, quality)
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + ".jpg")
+
+    def get(self, src_path, width, quality):
+        # returns the path of the variant, creating it if needed. the
+        # original is returned when it is not wider than width
+        st = os.stat(src_path)
+        cache_path = self._cache_path(src_path, st, width, quality)
+        with self.lock:
+            hit = cache_path in self.entries
+            if hit:
+                self.entries.move_to_end(cache_path)
+            else:
+                pending = self.pending.get(cache_path)
+                creating = pending is None
+                if creating:
+                    self.pending[cache_path] = threading.Event()
+        if hit:
+            try:
+                os.utime(cache_path)
+                return cache_path
+            except FileNotFoundError:
+                # evicted by another process
+                with self.lock:
+                    self._remove(cache_path)
+                return self.get(src_path, width, quality)
+        if not creating:
+            # another request (or the prefetch) is creating this variant
+            pending.wait()
+            return self.get(src_path, width, quality)
+        try:
+            try:
+                # created by another process using the cache dir
+                size = os.stat(cache_path).st_size
+                os.utime(cache_path)
+                created = True
+            except FileNotFoundError:
+                created = self._resize(src_path, cache_path, width, quality)
+                if created:
+                    size = os.path.getsize(cache_path)
+            if created:
+                with self.lock:
+                    self.entries[cache_path] = size
+                    self.total_bytes += size
+                    self._evict()
+                    rescan = time.time() - self.scanned_at > CACHE_RESCAN_SECONDS
+                    if rescan:
+                        self.scanned_at = time.time()
+                if rescan:
+                    self._scan()
+        finally:
+            with self.lock:
+                self.pending.pop(cache_path).set()
+        return cache_path if created else src_path
+
+    def _resize(self, src_path, cache_path, width, quality):
+        with Image.open(src_path) as img:
+            if img.width <= width:
+                return False
+            height = round(img.height * width / img.width)
+            # lets the jpeg decoder scale down by up to 8x while decoding
+            img.draft("RGB", (width, height))
+            img = img.convert("RGB").resize((width, height), Image.LANCZOS)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = "{}.{}-{}.tmp".format(cache_path, os.getpid(), threading.get_ident())
+        img.save(tmp_path, "JPEG", quality=quality)
+        os.replace(tmp_path, cache_path)
+        return True
+
+    def _remove(self, cache_path):
+        size = self.entries.pop(cache_path, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            cache_path, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(cache_path)
+            except FileNotFoundError:
+                pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_BYTES)
+        return _cache
+
+
+def file_etag(st, width=None, quality=THUMBNAIL_QUALITY):
+    # strong validator of an original with stat st, or of its variant at
+    # width and quality. variants are validated through their original since
+    # the cache touches the variant files to track recency
+    etag = "{:x}-{:x}-{:x}".format(st.st_ino, st.st_mtime_ns, st.st_size)
+    if width is not None:
+        etag += "-{}-{}".format(variant_width(int(width)), variant_quality(quality))
+    return etag
+
+
+def variant_width(width):
+    # smallest configured width that is at least width
+    for w in sorted(THUMBNAIL_WIDTHS):
+        if w >= width:
+            return w
+    return max(THUMBNAIL_WIDTHS)
+
+
+def variant_quality(quality):
+    return min(max(int(quality), 10), 95)
+
+
+def get_variant(src_path, width, quality=THUMBNAIL_QUALITY):
+    # path of the file to serve for src_path at the requested width
+    if Image is None:
+        # Pillow not installed, serve originals
+        return src_path
+    return get_cache().get(src_path, variant_width(int(width)), variant_quality(quality))
+
+
+# variants waiting for the warm_variants threads, oldest first. when the
+# explorer moves on faster than they are created, the oldest are dropped
+WARM_QUEUE_SIZE = 32
+
+_warm_queue = deque(maxlen=WARM_QUEUE_SIZE)
+_warm_queued = threading.Condition()
+_warm_threads = []
+
+
+def warm_variants(paths, width, quality=THUMBNAIL_QUALITY):
+    # creates the variants of paths (relative to BASE_PATH) in the
+    # background, e.g. for the images the explorer will show next
+    if Image is None and IMAGE_SERVER_URL is None:
+        return
+    with _warm_queued:
+        while len(_warm_threads) < THUMBNAIL_WARM_WORKERS:
+            thread = threading.Thread(target=_warm_worker, daemon=True)
+            thread.start()
+            _warm_threads.append(thread)
+        for path in paths:
+            job = (path, width, quality)
+            if job not in _warm_queue:
+                _warm_queue.append(job)
+        _warm_queued.notify_all()
+
+
+def _warm_worker():
+    while True:
+        with _warm_queued:
+            while len(_warm_queue) == 0:
+                _warm_queued.wait()
+            job = _warm_queue.popleft()
+        _warm(*job)
+
+
+def _warm(path, width, quality):
+    # creates the variant of path (relative to BASE_PATH). with an image
+    # server it is asked to create it, so that the variants the pages load
+    # are only made by one process
+    try:
+        if IMAGE_SERVER_URL is None:
+            get_variant(BASE_PATH + path, width, quality)
+            return
+        url = "{}/image/{}?w={}&q={}".format(
+            IMAGE_SERVER_URL, urllib.parse.quote(path), width, quality
+        )
+        # the image server creates the variant for HEAD requests too
+        request = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(request, timeout=WARM_TIMEOUT):
+            pass
+    except OSError as e:
+        print("could not resize", path, e)
+
+
+def pregenerate(paths, width, quality=THUMBNAIL_QUALITY, workers=SCAN_WORKERS):
+    # creates the variants of paths (relative to BASE_PATH) ahead of time
+    def generate(path):
+        _warm(path, width, quality)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, _ in enumerate(pool.map(generate, paths)):
+            if i % 1000 == 0:
+                print(i, "variants")
+
+
+if __name__ == "__main__":
+    from sqlitehelper import get_filelist_by_selection
+
+    parser = argparse.ArgumentParser(description="pre-generate resized variants")
+    parser.add_argument("--width", type=int, default=max(THUMBNAIL_WIDTHS))
+    parser.add_argument("--quality", type=int, default=THUMBNAIL_QUALITY)
+    parser.add_argument("--node", default=None, help="only the images of this node")
+    args = parser.parse_args()
+    paths = [row[0] for row in get_filelist_by_selection(args.node)]
+    print("generating", len(paths), "variants of width", variant_width(args.width))
+    pregenerate(paths, args.width, args.quality)
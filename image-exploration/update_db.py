@@ -1,10 +1,21 @@
+import sys
 from annot import *
 from configuration import BASE_PATH
 
 print("updating DB")
-print("set_all_not_available()")
-set_all_not_available()
-print("update_db from BASE_PATH", BASE_PATH)
-update_db(BASE_PATH)
+if "--full" in sys.argv:
+    print("full update_db from BASE_PATH", BASE_PATH)
+    update_db(BASE_PATH)
+    clear_scan_manifest()
+elif "--archive" in sys.argv:
+    # moves a past season out of the active DB, e.g. --archive 2022
+    archive_season(int(sys.argv[sys.argv.index("--archive") + 1]))
+elif "--watch" in sys.argv:
+    import watcher
+
+    watcher.watch(BASE_PATH)
+else:
+    print("incremental update_db from BASE_PATH", BASE_PATH)
+    update_db_incremental(BASE_PATH)
 
 print("available node id's:", get_node_ids())
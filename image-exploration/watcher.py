@@ -0,0 +1,95 @@
+import fnmatch
+import os
+import threading
+import time
+
+from annot import update_db_incremental
+from sqlitehelper import bulk_ingest, set_unavailable_from_list
+from configuration import WATCH_FLUSH_INTERVAL, WATCH_POLL_INTERVAL
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class AvailabilityHandler(FileSystemEventHandler):
+    # collects file events (inotify on linux) and applies them to the images
+    # table in batches; repeated events for the same file are coalesced
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.rescan = False
+
+    def _rel_path(self, path):
+        return os.path.relpath(path, self.base_path).replace("\\", "/")
+
+    def _mark(self, path, available):
+        if fnmatch.fnmatch(os.path.basename(path), "*.jpg"):
+            with self.lock:
+                self.pending[self._rel_path(path)] = available
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._mark(event.src_path, True)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            with self.lock:
+                self.rescan = True
+        else:
+            self._mark(event.src_path, False)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            with self.lock:
+                self.rescan = True
+            return
+        self._mark(event.src_path, False)
+        if os.path.abspath(event.dest_path).startswith(os.path.abspath(self.base_path)):
+            self._mark(event.dest_path, True)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            rescan, self.rescan = self.rescan, False
+        if rescan:
+            # a whole directory moved or vanished, let the manifest sort it out
+            update_db_incremental(self.base_path)
+            return
+        if len(pending) == 0:
+            return
+        appeared = [p for p, available in pending.items() if available]
+        vanished = [p for p, available in pending.items() if not available]
+        if len(appeared) > 0:
+            bulk_ingest(appeared, full_sync=False)
+        if len(vanished) > 0:
+            set_unavailable_from_list(vanished)
+            print("marked", len(vanished), "files unavailable")
+
+
+def watch(base_path):
+    # catch up with everything that changed while nobody was watching
+    update_db_incremental(base_path)
+    if Observer is None:
+        print("watchdog not installed, polling", base_path, "every", WATCH_POLL_INTERVAL, "s")
+        while True:
+            time.sleep(WATCH_POLL_INTERVAL)
+            update_db_incremental(base_path)
+
+    handler = AvailabilityHandler(base_path)
+    observer = Observer()
+    observer.schedule(handler, base_path, recursive=True)
+    observer.start()
+    print("watching", base_path)
+    try:
+        while True:
+            time.sleep(WATCH_FLUSH_INTERVAL)
+            handler.flush()
+    finally:
+        observer.stop()
+        observer.join()
+        handler.flush()